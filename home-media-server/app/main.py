@@ -2,13 +2,22 @@ from pathlib import Path
 from typing import Annotated
 
 from fastapi import FastAPI, HTTPException, Query, Request
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
+from app.metrics import MetricsMiddleware, registry
+from app.streaming import StreamScheduler, VideoFileResponse
+
 static_path = Path(__file__).parent / "static"
 templates_path = Path(__file__).parent / "templates"
 app = FastAPI()
+scheduler = StreamScheduler()
+
+# request timing and bytes per video on /metrics
+app.add_middleware(MetricsMiddleware)
+registry.gauge("streams_active", "Streams being served", lambda: scheduler.active)
+registry.gauge("streams_queued", "Streams waiting for a slot", lambda: scheduler.queued)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory=static_path), name="static")
@@ -30,51 +39,51 @@ async def movies(request: Request):
             {
                 "id": 1,
                 "title": "The Fast and Furious",
-                "image": "https://via.placeholder.com/200x300",
+                "image": "/static/img/poster.svg",
             },
             {
                 "id": 2,
                 "title": "Mission Impossible",
-                "image": "https://via.placeholder.com/200x300",
+                "image": "/static/img/poster.svg",
             },
             {
                 "id": 3,
                 "title": "Die Hard",
-                "image": "https://via.placeholder.com/200x300",
+                "image": "/static/img/poster.svg",
             },
         ],
         "Comedy": [
             {
                 "id": 4,
                 "title": "The Hangover",
-                "image": "https://via.placeholder.com/200x300",
+                "image": "/static/img/poster.svg",
             },
             {
                 "id": 5,
                 "title": "Superbad",
-                "image": "https://via.placeholder.com/200x300",
+                "image": "/static/img/poster.svg",
             },
             {
                 "id": 6,
                 "title": "Bridesmaids",
-                "image": "https://via.placeholder.com/200x300",
+                "image": "/static/img/poster.svg",
             },
         ],
         "Sci-Fi": [
             {
                 "id": 7,
                 "title": "Inception",
-                "image": "https://via.placeholder.com/200x300",
+                "image": "/static/img/poster.svg",
             },
             {
                 "id": 8,
                 "title": "Interstellar",
-                "image": "https://via.placeholder.com/200x300",
+                "image": "/static/img/poster.svg",
             },
             {
                 "id": 9,
                 "title": "The Matrix",
-                "image": "https://via.placeholder.com/200x300",
+                "image": "/static/img/poster.svg",
             },
         ],
     }
@@ -91,7 +100,7 @@ async def get_movie(request: Request, movie_id: int):
         "id": movie_id,
         "title": f"Movie {movie_id}",
         "description": "This is a sample movie description.",
-        "image": "https://via.placeholder.com/400x600",
+        "image": "/static/img/poster.svg",
         "year": 2023,
         "director": "Sample Director",
     }
@@ -101,25 +110,24 @@ async def get_movie(request: Request, movie_id: int):
 
 
 @app.get("/stream", name="stream")
-def stream_video(q: Annotated[str, Query()] = "sample.mp4"):
-    def iterfile(file_name: str):
-        # Ensure the file has .mp4 suffix
-        if not file_name.lower().endswith(".mp4"):
-            file_name = f"{file_name}.mp4"
-
-        # Try to find the file in static directory
-        file_path = static_path / file_name
-
-        # If file doesn't exist, fall back to sample.mp4
+async def stream_video(request: Request, q: Annotated[str, Query()] = "sample.mp4"):
+    file_name = q
+    # Ensure the file has .mp4 suffix
+    if not file_name.lower().endswith(".mp4"):
+        file_name = f"{file_name}.mp4"
+
+    # Try to find the file in static directory
+    file_path = static_path / file_name
+
+    # If file doesn't exist, fall back to sample.mp4
+    if not file_path.exists():
+        file_path = static_path / "sample.mp4"
         if not file_path.exists():
-            file_path = static_path / "sample.mp4"
-            if not file_path.exists():
-                raise HTTPException(status_code=404, detail="Video file not found")
-
-        with open(file_path, mode="rb") as file_like:
-            yield from file_like
+            raise HTTPException(status_code=404, detail="Video file not found")
 
-    return StreamingResponse(iterfile(q), media_type="video/mp4")
+    ticket = await scheduler.admit()
+    request.state.metrics_episode = file_path.stem
+    return VideoFileResponse(file_path, media_type="video/mp4", ticket=ticket)
 
 
 @app.get("/player", response_class=HTMLResponse, name="player")
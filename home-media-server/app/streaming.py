@@ -0,0 +1,344 @@
+"""
+Video delivery for the media servers
+
+Range handling (parsing, If-Range validation, 416s) comes from Starlette's
+FileResponse, this module only replaces how the bytes go out:
+
+- zero-copy: when the ASGI server advertises the `http.response.zerocopysend`
+  extension the server sendfile()s straight from the page cache
+- otherwise fixed, page-aligned chunks are read off the event loop
+- with a block cache (anything with `block_size`, `head_size` and
+  `get(key, path, index)`) and no zero-copy, the first `head_size` bytes of a
+  file, which every start and seek back to the beginning reads, come from
+  memory with the next block read ahead; the rest is read in chunks so one
+  viewer watching a whole movie doesn't evict everyone else's blocks
+
+StreamScheduler bounds how many streams a process serves at once: extra viewers
+wait in a FIFO queue or get a 503 with Retry-After, and file reads run on their
+own thread limiter so streams can't starve the threadpool the HTML routes use.
+
+The same file lives in yagizflix/app and home-media-server/app, keep them in sync.
+"""
+
+import mmap
+import os
+import time
+from collections import deque
+from collections.abc import Hashable
+from functools import partial
+from secrets import token_hex
+
+import anyio
+from fastapi import HTTPException
+from fastapi.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+ZERO_COPY_EXTENSION = "http.response.zerocopysend"
+
+
+def align_chunk_size(chunk_size: int) -> int:
+    """round up to a whole number of pages, so reads never straddle one"""
+    pages = max(1, -(-chunk_size // mmap.PAGESIZE))
+    return pages * mmap.PAGESIZE
+
+
+class StreamScheduler:
+    """
+    Admission control and pacing for concurrent streams in one process.
+
+    - at most `max_streams` streams are served at once, the next `max_queued`
+      viewers wait (first come, first served) up to `queue_timeout` seconds
+    - `bandwidth` bytes/s is split evenly between the active streams and
+      `stream_bandwidth` caps any single stream, 0 disables either limit
+    """
+
+    def __init__(
+        self,
+        max_streams: int = 32,
+        max_queued: int = 16,
+        queue_timeout: float = 5.0,
+        retry_after: int = 5,
+        bandwidth: int = 0,
+        stream_bandwidth: int = 0,
+    ) -> None:
+        self.max_streams = max_streams
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.bandwidth = bandwidth
+        self.stream_bandwidth = stream_bandwidth
+        self.active = 0
+        self._queue: deque[anyio.Event] = deque()
+        self._read_limiter: anyio.CapacityLimiter | None = None
+
+    @property
+    def read_limiter(self) -> anyio.CapacityLimiter:
+        # created lazily, it has to be bound to the running event loop
+        if self._read_limiter is None:
+            self._read_limiter = anyio.CapacityLimiter(self.max_streams)
+        return self._read_limiter
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    @property
+    def paced(self) -> bool:
+        return bool(self.bandwidth or self.stream_bandwidth)
+
+    def rate(self) -> float:
+        """current bytes/s allowance of a single stream, 0 means unpaced"""
+        rates = []
+        if self.bandwidth:
+            rates.append(self.bandwidth / max(1, self.active))
+        if self.stream_bandwidth:
+            rates.append(self.stream_bandwidth)
+        return min(rates, default=0)
+
+    async def admit(self) -> "StreamTicket":
+        if self.active < self.max_streams and not self._queue:
+            self.active += 1
+            return StreamTicket(self)
+
+        if len(self._queue) >= self.max_queued:
+            raise self._busy()
+
+        slot = anyio.Event()
+        self._queue.append(slot)
+        try:
+            with anyio.move_on_after(self.queue_timeout):
+                await slot.wait()
+        except BaseException:
+            # the viewer went away while queued, pass on a slot it was handed
+            if slot.is_set():
+                self.release()
+            else:
+                self._queue.remove(slot)
+            raise
+        if not slot.is_set():
+            self._queue.remove(slot)
+            raise self._busy()
+        # release() handed its slot over, `active` already counts this stream
+        return StreamTicket(self)
+
+    def release(self) -> None:
+        if self._queue:
+            self._queue.popleft().set()
+        else:
+            self.active -= 1
+
+    def _busy(self) -> HTTPException:
+        return HTTPException(
+            status_code=503,
+            detail="Too many concurrent streams",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+
+class StreamTicket:
+    """one admitted stream, paces its own sends and gives the slot back once"""
+
+    def __init__(self, scheduler: StreamScheduler) -> None:
+        self.scheduler = scheduler
+        self.released = False
+        self._due: float | None = None
+
+    async def pace(self, sent: int) -> None:
+        rate = self.scheduler.rate()
+        if not rate:
+            return
+        now = time.monotonic()
+        self._due = max(self._due or now, now - 1) + sent / rate
+        if self._due > now:
+            await anyio.sleep(self._due - now)
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.scheduler.release()
+
+
+class VideoFileResponse(FileResponse):
+    chunk_size = DEFAULT_CHUNK_SIZE
+
+    def __init__(
+        self,
+        *args,
+        chunk_size: int | None = None,
+        ticket: StreamTicket | None = None,
+        cache=None,
+        cache_key: Hashable = None,
+        **kwargs,
+    ) -> None:
+        self.file_size = 0
+        super().__init__(*args, **kwargs)
+        if chunk_size is not None:
+            self.chunk_size = align_chunk_size(chunk_size)
+        self.ticket = ticket
+        self.cache = cache
+        self.cache_key = cache_key if cache_key is not None else str(self.path)
+        self.zero_copy = False
+
+    def set_stat_headers(self, stat_result: os.stat_result) -> None:
+        super().set_stat_headers(stat_result)
+        self.file_size = stat_result.st_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.zero_copy = ZERO_COPY_EXTENSION in scope.get("extensions", {})
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.ticket is not None:
+                self.ticket.release()
+
+    @property
+    def read_limiter(self) -> anyio.CapacityLimiter | None:
+        return self.ticket.scheduler.read_limiter if self.ticket else None
+
+    async def _handle_simple(self, send: Send, send_header_only: bool) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        size = int(self.headers["content-length"])
+        await self.send_ranges(send, [(0, size)])
+
+    async def _handle_single_range(
+        self, send: Send, start: int, end: int, file_size: int, send_header_only: bool
+    ) -> None:
+        self.headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+        self.headers["content-length"] = str(end - start)
+        await send(
+            {"type": "http.response.start", "status": 206, "headers": self.raw_headers}
+        )
+        if send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        await self.send_ranges(send, [(start, end)])
+
+    async def _handle_multiple_ranges(
+        self,
+        send: Send,
+        ranges: list[tuple[int, int]],
+        file_size: int,
+        send_header_only: bool,
+    ) -> None:
+        # the multipart boundary belongs in Content-Type, a multipart/byteranges
+        # response must not carry a top-level Content-Range (RFC 9110 14.6),
+        # and the closing delimiter must match the advertised Content-Length
+        boundary = token_hex(13)
+        content_length, header_generator = self.generate_multipart(
+            ranges, boundary, file_size, self.headers["content-type"]
+        )
+        self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+        self.headers["content-length"] = str(content_length)
+        await send(
+            {"type": "http.response.start", "status": 206, "headers": self.raw_headers}
+        )
+        if send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        await self.send_ranges(
+            send,
+            ranges,
+            part_header=header_generator,
+            closing=f"--{boundary}--\n".encode("latin-1"),
+        )
+
+    async def send_ranges(
+        self,
+        send: Send,
+        ranges: list[tuple[int, int]],
+        part_header=None,
+        closing: bytes | None = None,
+    ) -> None:
+        """send each [start, end) range, optionally framed as multipart parts"""
+        file = await anyio.to_thread.run_sync(
+            open, self.path, "rb", 0, limiter=self.read_limiter
+        )
+        try:
+            for start, end in ranges:
+                if part_header is not None:
+                    await self.send_body(send, part_header(start, end))
+                if self.zero_copy:
+                    await self.send_zero_copy(send, file, start, end)
+                elif self.cache is not None and start < self.cache.head_size:
+                    head_end = min(end, self.cache.head_size)
+                    await self.send_cached(send, start, head_end)
+                    await self.send_chunks(send, file, head_end, end)
+                else:
+                    await self.send_chunks(send, file, start, end)
+                if part_header is not None:
+                    await self.send_body(send, b"\n")
+        finally:
+            await anyio.to_thread.run_sync(file.close, limiter=self.read_limiter)
+        await self.send_body(send, closing or b"", more_body=False)
+
+    async def send_zero_copy(self, send: Send, file, start: int, end: int) -> None:
+        # a paced stream hands the range over a chunk at a time
+        paced = self.ticket is not None and self.ticket.scheduler.paced
+        step = self.chunk_size if paced else end - start
+        while start < end:
+            count = min(step, end - start)
+            await send(
+                {
+                    "type": ZERO_COPY_EXTENSION,
+                    "file": file,
+                    "offset": start,
+                    "count": count,
+                    "more_body": True,
+                }
+            )
+            start += count
+            if self.ticket is not None:
+                await self.ticket.pace(count)
+
+    async def send_chunks(self, send: Send, file, start: int, end: int) -> None:
+        fd = file.fileno()
+        while start < end:
+            # the first read stops at a chunk boundary so every later read is aligned
+            size = min(self.chunk_size - start % self.chunk_size, end - start)
+            chunk = await anyio.to_thread.run_sync(
+                os.pread, fd, size, start, limiter=self.read_limiter
+            )
+            if not chunk:
+                break
+            start += len(chunk)
+            await self.send_body(send, chunk)
+            if self.ticket is not None:
+                await self.ticket.pace(len(chunk))
+
+    async def send_cached(self, send: Send, start: int, end: int) -> None:
+        block_size = self.cache.block_size
+        last_block = (min(self.file_size, self.cache.head_size) - 1) // block_size
+        get_block = partial(anyio.to_thread.run_sync, limiter=self.read_limiter)
+        async with anyio.create_task_group() as read_ahead:
+            index = start // block_size
+            while start < end:
+                block = await get_block(self.cache.get, self.cache_key, self.path, index)
+                if index < last_block:
+                    read_ahead.start_soon(
+                        get_block, self.cache.get, self.cache_key, self.path, index + 1
+                    )
+                block_start = index * block_size
+                chunk = block[start - block_start : end - block_start]
+                if not chunk:
+                    break
+                start += len(chunk)
+                index += 1
+                await self.send_body(send, chunk)
+                if self.ticket is not None:
+                    await self.ticket.pace(len(chunk))
+
+    async def send_body(self, send: Send, body: bytes, more_body: bool = True) -> None:
+        await send({"type": "http.response.body", "body": body, "more_body": more_body})
@@ -0,0 +1,234 @@
+"""
+Poster frames and seek-preview sprite sheets
+
+ffmpeg extracts a poster frame and a sprite sheet (a 10x10 grid of evenly
+spaced thumbnails) per episode in a process pool, off the request path.
+Images are stored content-addressed, `{artwork_path}/ab/abcdef....jpg` named by
+the sha256 of their bytes, and the `artwork` table maps an episode + kind to
+the digest made from the current version of its file.
+
+The per-episode URL serves the current image itself with the digest as its
+ETag, so a browser revalidates it with one request and no redirects. The
+player links the sprite by its digest URL, which can be cached forever.
+
+A render that fails is not retried before `retry_after` seconds, doubling
+with every further failure up to a day, so a file ffmpeg can't read (or a
+missing ffmpeg) costs one attempt per backoff instead of one per page view.
+
+Run `python -m app.artwork` to render everything ahead of time.
+"""
+
+import asyncio
+import hashlib
+import logging
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import anyio
+from sqlalchemy import Engine
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session
+
+from .models import Artwork
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("poster", "sprite")
+SPRITE_COLUMNS = SPRITE_ROWS = 10
+SPRITE_WIDTH = 160
+POSTER_WIDTH = 400
+MAX_RETRY_AFTER = 24 * 60 * 60
+
+
+def digest_path(root: Path, digest: str) -> Path:
+    return root / digest[:2] / f"{digest}.jpg"
+
+
+def sprite_interval(duration: float | None) -> float:
+    """seconds between the sprite's thumbnails"""
+    frames = SPRITE_COLUMNS * SPRITE_ROWS
+    return max((duration or frames) / frames, 1.0)
+
+
+def ffmpeg_command(
+    ffmpeg: str, kind: str, source: Path, duration: float | None, target: Path
+) -> list[str]:
+    if kind == "poster":
+        # a tenth in skips most cold opens and studio logos
+        seek = (duration or 0) * 0.1
+        return [
+            ffmpeg, "-nostdin", "-loglevel", "error", "-y",
+            "-ss", f"{seek:.2f}", "-i", str(source),
+            "-frames:v", "1", "-vf", f"scale={POSTER_WIDTH}:-2", "-q:v", "3",
+            str(target),
+        ]  # fmt: skip
+
+    interval = sprite_interval(duration)
+    return [
+        ffmpeg, "-nostdin", "-loglevel", "error", "-y",
+        "-i", str(source),
+        "-vf", f"fps=1/{interval:.3f},scale={SPRITE_WIDTH}:-2,"
+        f"tile={SPRITE_COLUMNS}x{SPRITE_ROWS}",
+        "-frames:v", "1", "-q:v", "5",
+        str(target),
+    ]  # fmt: skip
+
+
+def render(
+    ffmpeg: str, kind: str, source: Path, duration: float | None, root: Path
+) -> str:
+    """render one image and store it under its digest, runs in a worker process"""
+    with tempfile.TemporaryDirectory() as scratch:
+        target = Path(scratch) / f"{kind}.jpg"
+        subprocess.run(
+            ffmpeg_command(ffmpeg, kind, source, duration, target),
+            check=True,
+            capture_output=True,
+        )
+        image = target.read_bytes()
+
+    digest = hashlib.sha256(image).hexdigest()
+    path = digest_path(root, digest)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        scratch_path = path.with_suffix(".tmp")
+        scratch_path.write_bytes(image)
+        scratch_path.replace(path)
+    return digest
+
+
+def save_artwork(
+    engine: Engine, episode_id: int, kind: str, source_mtime_ns: int, digest: str
+) -> None:
+    statement = sqlite_insert(Artwork).values(
+        episode_id=episode_id, kind=kind, source_mtime_ns=source_mtime_ns, digest=digest
+    )
+    with Session(engine) as session:
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=[Artwork.episode_id, Artwork.kind],
+                set_={
+                    "source_mtime_ns": statement.excluded.source_mtime_ns,
+                    "digest": statement.excluded.digest,
+                },
+            )
+        )
+        session.commit()
+
+
+class ArtworkGenerator:
+    def __init__(
+        self,
+        engine: Engine,
+        root: Path,
+        ffmpeg: str = "ffmpeg",
+        workers: int = 2,
+        retry_after: float = 300.0,
+    ) -> None:
+        self.engine = engine
+        self.root = root
+        self.ffmpeg = ffmpeg
+        self.workers = workers
+        self.retry_after = retry_after
+        self._pool: ProcessPoolExecutor | None = None
+        # the event loop only keeps weak references to tasks
+        self._jobs: dict[tuple[int, str], asyncio.Task] = {}
+        # (episode, kind) -> failures in a row and the monotonic time to retry at
+        self._failures: dict[tuple[int, str], tuple[int, float]] = {}
+
+    def current(self, artwork: Artwork | None, source: Path) -> Path | None:
+        """the stored image if it was made from this version of the file"""
+        if artwork is None or artwork.source_mtime_ns != source.stat().st_mtime_ns:
+            return None
+        path = digest_path(self.root, artwork.digest)
+        return path if path.is_file() else None
+
+    def schedule(
+        self, episode_id: int, kind: str, source: Path, duration: float | None
+    ) -> None:
+        if self.workers <= 0:
+            return
+        key = (episode_id, kind)
+        failure = self._failures.get(key)
+        if failure is not None and time.monotonic() < failure[1]:
+            return
+        if key in self._jobs:
+            return
+        task = asyncio.create_task(self.generate(episode_id, kind, source, duration))
+        self._jobs[key] = task
+        task.add_done_callback(lambda task: self._finished(key, task))
+
+    async def generate(
+        self, episode_id: int, kind: str, source: Path, duration: float | None
+    ) -> None:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        mtime_ns = source.stat().st_mtime_ns
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(
+            self._pool, render, self.ffmpeg, kind, source, duration, self.root
+        )
+        await anyio.to_thread.run_sync(
+            save_artwork, self.engine, episode_id, kind, mtime_ns, digest
+        )
+
+    def _finished(self, key: tuple[int, str], task: asyncio.Task) -> None:
+        self._jobs.pop(key, None)
+        if task.cancelled():
+            return
+        if task.exception() is None:
+            self._failures.pop(key, None)
+            return
+        count = self._failures.get(key, (0, 0.0))[0] + 1
+        delay = min(self.retry_after * 2 ** (count - 1), MAX_RETRY_AFTER)
+        self._failures[key] = (count, time.monotonic() + delay)
+        logger.error(
+            "rendering %s for episode %s failed, retrying in %ds",
+            key[1],
+            key[0],
+            delay,
+            exc_info=task.exception(),
+        )
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+if __name__ == "__main__":
+    from sqlmodel import select
+
+    from app.config import get_app_settings
+    from app.database import create_db_and_tables, engine
+    from app.models import Episode
+
+    settings = get_app_settings()
+    create_db_and_tables()
+    with Session(engine) as session:
+        episodes = [
+            (episode.id, episode.name, episode.probe.duration if episode.probe else None)
+            for episode in session.exec(select(Episode)).all()
+        ]
+
+    with ProcessPoolExecutor(max_workers=settings.artwork_workers) as pool:
+        jobs = {}
+        for episode_id, name, duration in episodes:
+            source = settings.movies_path / f"{name}.mp4"
+            if not source.is_file():
+                continue
+            for kind in KINDS:
+                args = (settings.ffmpeg_path, kind, source, duration, settings.artwork_path)
+                jobs[pool.submit(render, *args)] = (episode_id, kind, source)
+
+        for future, (episode_id, kind, source) in jobs.items():
+            try:
+                digest = future.result()
+            except (OSError, subprocess.CalledProcessError) as error:
+                print(f"episode {episode_id} {kind}: {error}")
+                continue
+            save_artwork(engine, episode_id, kind, source.stat().st_mtime_ns, digest)
+            print(f"episode {episode_id} {kind}: {digest}")
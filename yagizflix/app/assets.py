@@ -0,0 +1,188 @@
+"""
+Static asset pipeline
+
+`python -m app.assets` copies every file under `static_path` (except the
+media library) to `assets_path` under a name with a hash of its content,
+`css/movies.css` -> `css/movies.1f2e3d4c5b6a.css`, writes `.gz` and `.br`
+(with brotli installed) siblings for text formats when they come out smaller,
+and a `manifest.json` mapping each original name to its hashed one.
+
+Templates link assets through `asset_url('css/movies.css')`, which resolves
+the hashed name from the manifest. A hashed URL names one version of a file
+forever, so `AssetFiles` serves it with `Cache-Control: immutable` and
+picks the precompressed sibling the client accepts, nothing is compressed per
+request. Changing a file and rebuilding changes its URL. Earlier builds are
+kept, so pages cached with older URLs still load.
+
+Without a build `asset_url` falls back to the original name, served from
+`static_path` with `no-cache`, so development needs no build step.
+
+Episode files never go through here, they are streamed by the player routes
+with range support, the block cache and admission control.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+from collections.abc import Callable, Sequence
+from pathlib import Path
+
+from fastapi import HTTPException
+from fastapi.requests import Request
+from fastapi.responses import FileResponse, Response
+from jinja2 import pass_context
+from starlette.datastructures import URL, Headers
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from .config import get_app_settings
+from .page_cache import accepted_encodings
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - gzip only
+    brotli = None
+
+MANIFEST_NAME = "manifest.json"
+COMPRESSIBLE = {".css", ".js", ".mjs", ".svg", ".json", ".html", ".txt", ".xml", ".map"}
+IMMUTABLE = "public, max-age=31536000, immutable"
+# served only when the client accepts it, best first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def compressors() -> dict[str, Callable[[bytes], bytes]]:
+    found = {"gzip": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        found["br"] = lambda data: brotli.compress(data, quality=11)
+    return found
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    scratch = path.with_name(f".{path.name}.tmp")
+    scratch.write_bytes(data)
+    scratch.replace(path)
+
+
+def build(source: Path, output: Path, excluded: Sequence[Path] = ()) -> dict[str, dict]:
+    """fingerprint and precompress everything under `source`, returns the manifest"""
+    suffixes = dict(ENCODINGS)
+    manifest = {}
+    for file in sorted(source.rglob("*")):
+        if not file.is_file() or file.name.startswith("."):
+            continue
+        if any(file.is_relative_to(path) for path in excluded):
+            continue
+        relative = file.relative_to(source)
+        content = file.read_bytes()
+        digest = hashlib.sha256(content).hexdigest()[:12]
+        hashed = relative.with_name(f"{relative.stem}.{digest}{relative.suffix}")
+        target = output / hashed
+        if not target.is_file():
+            write_atomic(target, content)
+
+        encodings = []
+        if relative.suffix.lower() in COMPRESSIBLE:
+            for coding, compress in compressors().items():
+                sibling = target.with_name(target.name + suffixes[coding])
+                if not sibling.is_file():
+                    compressed = compress(content)
+                    # a few percent isn't worth a Vary and a second file
+                    if len(compressed) > len(content) * 0.9:
+                        continue
+                    write_atomic(sibling, compressed)
+                encodings.append(coding)
+        manifest[relative.as_posix()] = {"path": hashed.as_posix(), "encodings": encodings}
+
+    write_atomic(output / MANIFEST_NAME, json.dumps(manifest, indent=2).encode())
+    return manifest
+
+
+class AssetManifest:
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.load()
+
+    def load(self) -> None:
+        try:
+            entries = json.loads((self.root / MANIFEST_NAME).read_bytes())
+        except FileNotFoundError:
+            entries = {}
+        self.paths: dict[str, str] = {
+            name: entry["path"] for name, entry in entries.items()
+        }
+        # hashed name -> the precompressed siblings it has
+        self.encodings: dict[str, list[str]] = {
+            entry["path"]: entry["encodings"] for entry in entries.values()
+        }
+
+    def resolve(self, path: str) -> str:
+        """the hashed name of `path`, or `path` itself when it wasn't built"""
+        return self.paths.get(path, path)
+
+
+class AssetFiles(StaticFiles):
+    """
+    built assets first, then the plain static directory; everything under
+    `excluded` (the media library) is left to the streaming routes
+    """
+
+    def __init__(
+        self, manifest: AssetManifest, directory: Path, excluded: Sequence[Path] = ()
+    ) -> None:
+        super().__init__(directory=directory)
+        self.manifest = manifest
+        self.all_directories = [manifest.root, directory]
+        self.excluded = [
+            path.relative_to(directory)
+            for path in excluded
+            if path.is_relative_to(directory)
+        ]
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if any(Path(path).is_relative_to(excluded) for excluded in self.excluded):
+            raise HTTPException(status_code=404)
+
+        encodings = self.manifest.encodings.get(Path(path).as_posix())
+        if encodings is None:
+            # not fingerprinted, its URL stays the same when it changes
+            response = await super().get_response(path, scope)
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+        file_path = self.manifest.root / path
+        headers = {"Cache-Control": IMMUTABLE}
+        if encodings:
+            headers["Vary"] = "Accept-Encoding"
+            accepted = accepted_encodings(Request(scope))
+            for coding, suffix in ENCODINGS:
+                if coding in encodings and coding in accepted:
+                    headers["Content-Encoding"] = coding
+                    file_path = file_path.with_name(file_path.name + suffix)
+                    break
+
+        media_type, _ = mimetypes.guess_type(path)
+        response = FileResponse(file_path, media_type=media_type, headers=headers)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+settings = get_app_settings()
+assets = AssetManifest(settings.assets_path)
+
+
+@pass_context
+def asset_url(context, path: str) -> URL:
+    """the URL of a file under static_path, fingerprinted once built"""
+    return context["request"].url_for("static", path=assets.resolve(path))
+
+
+if __name__ == "__main__":
+    manifest = build(settings.static_path, settings.assets_path, [settings.movies_path])
+    for name, entry in manifest.items():
+        encodings = ", ".join(entry["encodings"]) or "uncompressed"
+        print(f"{name} -> {entry['path']} ({encodings})")
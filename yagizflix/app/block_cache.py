@@ -0,0 +1,132 @@
+"""
+In-process cache of video file blocks
+
+Keeps the most recently served fixed-size blocks from the first `head_size`
+bytes of episode files in memory, keyed by `(episode key, block index)`, and
+evicts least recently used blocks once `max_bytes` is exceeded. Only the
+head is cached, it is what every start and seek back to the beginning reads,
+and the streaming code reads past it in chunks (or zero-copies everything
+when the server can). Concurrent misses on the same block wait for the
+one read already in flight, so several viewers starting the same episode cost
+a single read from (possibly network-mounted) storage.
+
+With `use_mmap` blocks are copied out of a shared read-only mapping of the file
+instead of pread()s, which saves a syscall per block on local disks. At most
+`max_maps` files stay mapped, the least recently used mapping is closed.
+"""
+
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Hashable
+from pathlib import Path
+
+
+class BlockCache:
+    def __init__(
+        self,
+        max_bytes: int,
+        block_size: int,
+        head_size: int,
+        use_mmap: bool = False,
+        max_maps: int = 64,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        # whole blocks, so a cached block never reaches past the head
+        self.head_size = head_size // block_size * block_size
+        self.use_mmap = use_mmap
+        self.max_maps = max_maps
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks: OrderedDict[tuple[Hashable, int], bytes] = OrderedDict()
+        self._loading: dict[tuple[Hashable, int], threading.Event] = {}
+        self._maps: OrderedDict[Hashable, mmap.mmap] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, path: Path, index: int) -> bytes:
+        """block `index` of the file at `path`, blocking on a miss"""
+        block_key = (key, index)
+        with self._lock:
+            block = self._blocks.get(block_key)
+            if block is not None:
+                self._blocks.move_to_end(block_key)
+                self.hits += 1
+                return block
+            loading = self._loading.get(block_key)
+            owner = loading is None
+            if owner:
+                loading = self._loading[block_key] = threading.Event()
+
+        if not owner:
+            # another thread is reading this block, wait for it
+            loading.wait()
+            with self._lock:
+                block = self._blocks.get(block_key)
+                if block is not None:
+                    self.hits += 1
+                    return block
+            # it failed or was evicted meanwhile, read it ourselves uncached
+            return self.read(key, path, index)
+
+        try:
+            block = self.read(key, path, index)
+            self.store(block_key, block)
+        finally:
+            with self._lock:
+                del self._loading[block_key]
+            loading.set()
+        return block
+
+    def read(self, key: Hashable, path: Path, index: int) -> bytes:
+        offset = index * self.block_size
+        if self.use_mmap:
+            try:
+                return self.mapping(key, path)[offset : offset + self.block_size]
+            except ValueError:
+                pass  # evicted while another file was mapped, pread instead
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            return os.pread(fd, self.block_size, offset)
+        finally:
+            os.close(fd)
+
+    def mapping(self, key: Hashable, path: Path) -> mmap.mmap:
+        with self._lock:
+            mapped = self._maps.get(key)
+            if mapped is not None:
+                self._maps.move_to_end(key)
+                return mapped
+            with open(path, "rb") as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[key] = mapped
+            while len(self._maps) > self.max_maps:
+                _, evicted = self._maps.popitem(last=False)
+                evicted.close()
+            return mapped
+
+    def store(self, block_key: tuple[Hashable, int], block: bytes) -> None:
+        with self._lock:
+            self.misses += 1
+            if len(block) > self.max_bytes:
+                return
+            self._blocks[block_key] = block
+            self.size += len(block)
+            while self.size > self.max_bytes:
+                _, evicted = self._blocks.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._blocks.clear()
+            self.size = 0
+            for mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
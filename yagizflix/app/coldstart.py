@@ -0,0 +1,72 @@
+"""
+Cold start budget
+
+`python -m app.coldstart [budget seconds]` starts a fresh interpreter, imports
+the app under `-X importtime` and runs its lifespan up to the point it would
+accept requests, the same work a restarted container does. It prints the
+import and startup time, the slowest imports, and exits non-zero when the
+total is over budget (1 second by default), so it can gate a build.
+
+The library watcher is left off, its first scan runs in the background and
+doesn't delay serving.
+"""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+PROBE = """
+import asyncio, json, time
+started = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+
+async def serve():
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+        print(json.dumps({"import": imported - started, "startup": ready - imported}))
+
+asyncio.run(serve())
+"""
+
+
+def slowest_imports(importtime: str, count: int = 15) -> list[tuple[int, str]]:
+    """(cumulative µs, module) of the slowest imports in -X importtime output"""
+    imports = []
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            imports.append((int(cumulative), name.rstrip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def measure() -> tuple[dict, list[tuple[int, str]]]:
+    environment = {**os.environ, "WATCH_LIBRARY": "false"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=Path(__file__).parent.parent,
+        env=environment,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    return timings, slowest_imports(result.stderr)
+
+
+if __name__ == "__main__":
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    timings, imports = measure()
+    total = timings["import"] + timings["startup"]
+
+    print("slowest imports (cumulative):")
+    for microseconds, name in imports:
+        print(f"  {microseconds / 1000:8.1f} ms {name}")
+    print(f"import  {timings['import']:.3f}s")
+    print(f"startup {timings['startup']:.3f}s")
+    print(f"total   {total:.3f}s of a {budget:.3f}s budget")
+    sys.exit(0 if total <= budget else 1)
@@ -1,5 +1,6 @@
 from functools import lru_cache
 from pathlib import Path
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 
@@ -7,6 +8,78 @@ class AppSettings(BaseSettings):
     base_path: Path = Path(__file__).parent
     templates_path: Path = base_path / "templates"
     static_path: Path = base_path / "static"
+    movies_path: Path = static_path / "movies"
+
+    # compiled templates survive restarts here, see app.rendering
+    template_cache_path: Path = base_path / ".template_cache"
+    templates_auto_reload: bool = True
+
+    # fingerprinted, precompressed copies of static_path, see app.assets
+    assets_path: Path = base_path / "assets"
+
+    # SQLite engine profile, WAL lets readers run while progress is written
+    database_url: str = "sqlite:///episodes.db"
+    db_journal_mode: str = "WAL"
+    db_synchronous: str = "NORMAL"
+    db_mmap_size: int = 256 * 1024 * 1024
+    db_cache_size: int = -64 * 1024  # negative is KiB, so 64 MiB per connection
+    db_busy_timeout: int = 5000  # ms
+    db_pool_size: int = 4
+    db_read_pool_size: int = 16
+
+    # seconds between watch progress writes, heartbeats are coalesced in memory
+    progress_flush_interval: float = 10.0
+
+    # worker processes started by app.serve; with more than one they share
+    # caches, invalidation and a single writer through this directory
+    workers: int = 1
+    shared_state_path: Optional[Path] = None
+
+    # keep the catalogue in sync with movies_path while the app runs
+    watch_library: bool = True
+    library_watch_debounce_ms: int = 500
+    library_poll_interval: float = 60.0  # only without watchfiles
+
+    # HLS packaging output, segments there are immutable
+    hls_path: Path = base_path / "hls"
+    hls_segment_duration: int = 6
+    ffmpeg_path: str = "ffmpeg"
+
+    # posters and sprite sheets, stored by digest and rendered in a process pool
+    artwork_path: Path = base_path / "artwork"
+    artwork_workers: int = 2  # 0 renders nothing, the placeholder is served
+    # seconds before a failed render is tried again, doubling per failure
+    artwork_retry_after: float = 300.0
+
+    # lower bitrate renditions made in the background, see app.renditions;
+    # ffmpeg processes at once (0 disables transcoding) and threads for each,
+    # no new job starts while transcode_pause_streams streams are playing
+    renditions_path: Path = base_path / "renditions"
+    transcode_workers: int = 1
+    transcode_threads: int = 2
+    transcode_niceness: int = 10
+    transcode_pause_streams: int = 8
+    transcode_poll_interval: float = 5.0
+
+    # bytes per read when the server can't sendfile, rounded up to whole pages
+    stream_chunk_size: int = 1024 * 1024
+
+    # memory for recently served blocks of episode files, 0 disables the cache.
+    # Only the first block_cache_head_size bytes of a file are cached, and only
+    # when the server can't sendfile
+    block_cache_size: int = 256 * 1024 * 1024
+    block_cache_head_size: int = 8 * 1024 * 1024
+    block_cache_mmap: bool = False
+
+    # concurrent streams per process, overflow queues then gets a 503
+    max_concurrent_streams: int = 32
+    stream_queue_size: int = 16
+    stream_queue_timeout: float = 5.0
+    stream_retry_after: int = 5
+
+    # bytes/s shared by all streams and per single stream, 0 is unlimited
+    stream_bandwidth: int = 0
+    stream_max_bandwidth: int = 0
 
 
 @lru_cache
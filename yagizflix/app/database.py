@@ -1,16 +1,55 @@
 from typing import Annotated
 
 from fastapi import Depends
+from sqlalchemy import Engine, event
 from sqlmodel import Session as SQLModelSession
 from sqlmodel import create_engine
 
-from .models import Episode, SQLModel, Tag, Title
-
-engine = create_engine("sqlite:///episodes.db")
+from .config import AppSettings, get_app_settings
+from .models import Episode, Tag, Title
+from .migrations import migrate
+from .progress import ProgressBuffer
+
+
+def create_sqlite_engine(settings: AppSettings, read_only: bool = False) -> Engine:
+    pool_size = settings.db_read_pool_size if read_only else settings.db_pool_size
+    engine = create_engine(
+        settings.database_url,
+        pool_size=pool_size,
+        max_overflow=pool_size,
+        connect_args={
+            "check_same_thread": False,
+            "timeout": settings.db_busy_timeout / 1000,
+        },
+    )
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not read_only:
+            # persistent, set once by the writer
+            cursor.execute(f"PRAGMA journal_mode = {settings.db_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous = {settings.db_synchronous}")
+        cursor.execute(f"PRAGMA mmap_size = {int(settings.db_mmap_size)}")
+        cursor.execute(f"PRAGMA cache_size = {int(settings.db_cache_size)}")
+        cursor.execute(f"PRAGMA busy_timeout = {int(settings.db_busy_timeout)}")
+        if read_only:
+            cursor.execute("PRAGMA query_only = ON")
+        cursor.close()
+
+    return engine
+
+
+engine = create_sqlite_engine(get_app_settings())
+read_engine = create_sqlite_engine(get_app_settings(), read_only=True)
+progress_buffer = ProgressBuffer(
+    engine, interval=get_app_settings().progress_flush_interval
+)
 
 
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    # a single pragma read once the schema is current, see app.migrations
+    migrate(engine)
 
 
 def get_session():
@@ -18,7 +57,14 @@ def get_session():
         yield session
 
 
+def get_read_session():
+    with SQLModelSession(read_engine) as session:
+        yield session
+
+
 Session = Annotated[SQLModelSession, Depends(get_session)]
+# for routes that only read, served from their own pool of query_only connections
+ReadSession = Annotated[SQLModelSession, Depends(get_read_session)]
 
 
 def populate_db():
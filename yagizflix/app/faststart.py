@@ -0,0 +1,207 @@
+"""
+Faststart remuxer
+
+Rewrites MP4s whose `moov` atom sits after `mdat` so that it comes first, the
+way `qt-faststart` does: the boxes before `mdat` stay in front, `moov` is moved
+right behind them and every chunk offset in its `stco`/`co64` tables is shifted
+by the size of the moved `moov`. Media data is copied untouched, nothing is
+re-encoded. When shifted offsets no longer fit 32 bits the `stco` tables are
+widened to `co64`.
+
+The file is written next to the original and swapped in with an atomic rename,
+viewers that already have it open keep reading the old copy.
+
+`python -m app.faststart` remuxes every probed episode that isn't faststart
+yet and re-probes it, so each file is only rewritten once;
+`python -m app.faststart FILE...` remuxes the given files.
+"""
+
+import os
+import shutil
+import struct
+import sys
+from pathlib import Path
+
+from sqlalchemy import Engine
+from sqlmodel import Session, select
+
+from .models import MediaProbe
+from .probe import iter_boxes, probe_row, save_probes
+
+# boxes on the way from moov down to the chunk offset tables
+CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts", b"dinf", b"mvex"}
+UINT32_MAX = 0xFFFFFFFF
+
+
+class FaststartError(Exception):
+    pass
+
+
+def parse(data: bytes, offset: int = 0, end: int | None = None) -> list:
+    """box tree of `data` as [type, children-or-payload] pairs"""
+    end = len(data) if end is None else end
+    boxes = []
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header_size = 8
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", data, offset + 8)
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise FaststartError(f"corrupt {box_type!r} box at {offset}")
+        payload_start, payload_end = offset + header_size, offset + size
+        if box_type in CONTAINERS:
+            boxes.append([box_type, parse(data, payload_start, payload_end)])
+        else:
+            boxes.append([box_type, data[payload_start:payload_end]])
+        offset += size
+    return boxes
+
+
+def serialize(boxes: list) -> bytes:
+    out = bytearray()
+    for box_type, content in boxes:
+        payload = serialize(content) if isinstance(content, list) else content
+        size = len(payload) + 8
+        if size > UINT32_MAX:
+            out += struct.pack(">I4sQ", 1, box_type, size + 8)
+        else:
+            out += struct.pack(">I4s", size, box_type)
+        out += payload
+    return out
+
+
+def offset_tables(boxes: list):
+    for box in boxes:
+        box_type, content = box
+        if isinstance(content, list):
+            yield from offset_tables(content)
+        elif box_type in (b"stco", b"co64"):
+            yield box
+
+
+def read_offsets(box: list) -> list[int]:
+    box_type, payload = box
+    (count,) = struct.unpack_from(">I", payload, 4)
+    width = "I" if box_type == b"stco" else "Q"
+    return list(struct.unpack_from(f">{count}{width}", payload, 8))
+
+
+def write_offsets(box: list, offsets: list[int], wide: bool) -> None:
+    width = "Q" if wide else "I"
+    box[0] = b"co64" if wide else b"stco"
+    version_flags = box[1][:4]
+    box[1] = version_flags + struct.pack(f">I{len(offsets)}{width}", len(offsets), *offsets)
+
+
+def patch_moov(moov: bytes, shift, wide: bool) -> bytes:
+    tree = parse(moov)
+    for box in offset_tables(tree):
+        offsets = [shift(offset) for offset in read_offsets(box)]
+        write_offsets(box, offsets, wide or box[0] == b"co64")
+    return serialize(tree)
+
+
+def faststart(path: Path) -> bool:
+    """move moov in front of mdat, False if the file already is faststart"""
+    size = path.stat().st_size
+    with open(path, "rb") as file:
+        boxes = list(iter_boxes(file, 0, size))
+        moov = next((box for box in boxes if box.type == b"moov"), None)
+        mdat = next((box for box in boxes if box.type == b"mdat"), None)
+        if moov is None or mdat is None:
+            raise FaststartError(f"{path} has no moov/mdat pair")
+        if moov.offset < mdat.offset:
+            return False
+        if any(box.type == b"moof" for box in boxes):
+            raise FaststartError(f"{path} is fragmented, it has no single moov to move")
+
+        file.seek(moov.offset)
+        original_moov = file.read(moov.size)
+
+        # everything from the first mdat up to the old moov moves back by the
+        # new moov's size, what sat behind the old moov only by the size change
+        front = [box for box in boxes if box.offset < mdat.offset]
+        insert_at = mdat.offset
+
+        def build(wide: bool) -> bytes:
+            new_moov_size = len(patch_moov(original_moov, lambda offset: offset, wide))
+
+            def shift(offset: int) -> int:
+                if insert_at <= offset < moov.offset:
+                    return offset + new_moov_size
+                if offset >= moov.end:
+                    return offset + new_moov_size - moov.size
+                return offset
+
+            return patch_moov(original_moov, shift, wide)
+
+        try:
+            new_moov = build(wide=False)
+        except struct.error:
+            # a shifted offset doesn't fit 32 bits, widen stco to co64
+            new_moov = build(wide=True)
+
+        scratch = path.with_name(f".{path.name}.faststart")
+        try:
+            with open(scratch, "wb") as out:
+                for box in front:
+                    copy_range(file, out, box.offset, box.size)
+                out.write(new_moov)
+                for box in boxes:
+                    if box.offset >= mdat.offset and box is not moov:
+                        copy_range(file, out, box.offset, box.size)
+                out.flush()
+                os.fsync(out.fileno())
+            shutil.copymode(path, scratch)
+            os.replace(scratch, path)
+        finally:
+            scratch.unlink(missing_ok=True)
+    return True
+
+
+def copy_range(source, target, offset: int, count: int, chunk_size: int = 1024 * 1024):
+    source.seek(offset)
+    while count > 0:
+        chunk = source.read(min(chunk_size, count))
+        if not chunk:
+            raise FaststartError("file ended early")
+        target.write(chunk)
+        count -= len(chunk)
+
+
+def faststart_library(engine: Engine) -> list[Path]:
+    """remux every probed file that isn't faststart yet and store its new probe"""
+    with Session(engine) as session:
+        pending = session.exec(
+            select(MediaProbe).where(MediaProbe.moov_at_front == False)  # noqa: E712
+        ).all()
+
+    done = []
+    for probe in pending:
+        path = Path(probe.path)
+        try:
+            remuxed = faststart(path)
+        except (OSError, FaststartError) as error:
+            print(f"skipping {path}: {error}", file=sys.stderr)
+            continue
+        with Session(engine) as session:
+            save_probes(session, [probe_row(probe.episode_id, path)])
+            session.commit()
+        if remuxed:
+            done.append(path)
+    return done
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        for name in sys.argv[1:]:
+            print(f"{name}: {'remuxed' if faststart(Path(name)) else 'already faststart'}")
+    else:
+        from app.database import create_db_and_tables, engine
+
+        create_db_and_tables()
+        for path in faststart_library(engine):
+            print(f"{path}: remuxed")
@@ -1,39 +1,126 @@
+import asyncio
 from contextlib import asynccontextmanager
+from pathlib import Path
 
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse
 from fastapi.requests import Request
-from fastapi.templating import Jinja2Templates
 
+from app.assets import AssetFiles, assets
 from app.config import get_app_settings
-from app.routers import player_router, titles_router
-from app.database import create_db_and_tables
+from app.routers import api_router, player_router, titles_router
+from app.routers.player import artwork, block_cache, scheduler, transcoder
+from app.database import create_db_and_tables, engine, progress_buffer, read_engine
+from app.metrics import MetricsMiddleware, registry
+from app.page_cache import catalogue_generation, page_cache
+from app.rendering import templates
+from app.shared import DiskStore, LeaderLock, ProgressSpool, SharedCounter
+from app.sql_metrics import instrument_engine
+from app.suggest import suggest_index
+from app.watcher import LibraryWatcher
+from sqlmodel import Session
 
 settings = get_app_settings()
-templates = Jinja2Templates(directory=settings.templates_path)
+
+
+def share_state(path: Path) -> LeaderLock:
+    """coordinate with the other workers through `path`, see app.shared"""
+    catalogue_generation.shared = SharedCounter(path / "catalogue.generation")
+    page_cache.disk = DiskStore(path / "pages", page_cache.max_entries)
+    progress_buffer.spool = ProgressSpool(path / "progress.spool")
+    progress_buffer.leader = LeaderLock(path / "leader.lock")
+    return progress_buffer.leader
+
+
+def claim_catalogue(path: Path) -> LeaderLock:
+    """without shared state no other process may serve this catalogue"""
+    lock = LeaderLock(path)
+    if not lock.try_acquire():
+        raise RuntimeError(
+            f"another process holds {path}; run several workers with "
+            "`python -m app.serve --workers N` or set SHARED_STATE_PATH for all of them"
+        )
+    return lock
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    if settings.shared_state_path is not None:
+        leader = share_state(settings.shared_state_path)
+    else:
+        leader = claim_catalogue(Path(f"{engine.url.database}.lock"))
     create_db_and_tables()
     # populate_db()
+    with Session(engine) as session:
+        suggest_index.load(session)
+
+    flusher = asyncio.create_task(progress_buffer.run())
+    watcher = LibraryWatcher(
+        engine,
+        settings.movies_path,
+        debounce_ms=settings.library_watch_debounce_ms,
+        poll_interval=settings.library_poll_interval,
+    )
+
+    async def lead():
+        # one watcher and transcoding queue per deployment, a follower takes
+        # over if the leader exits
+        while not leader.try_acquire():
+            await asyncio.sleep(settings.progress_flush_interval)
+        if settings.watch_library:
+            watcher.start()
+        await transcoder.run()
+
+    election = asyncio.create_task(lead())
     yield
+    election.cancel()
+    await watcher.stop()
+    flusher.cancel()
+    progress_buffer.flush()
+    artwork.shutdown()
+    leader.release()
 
 
 app = FastAPI(lifespan=lifespan)
 
-# Mount static files
+# request timing, SQL per request and the gauges below on /metrics
+app.add_middleware(MetricsMiddleware, count_queries=True)
+instrument_engine(engine, "write")
+instrument_engine(read_engine, "read")
+registry.gauge("streams_active", "Streams being served", lambda: scheduler.active)
+registry.gauge("streams_queued", "Streams waiting for a slot", lambda: scheduler.queued)
+registry.gauge(
+    "block_cache_hit_ratio",
+    "Video blocks served from memory",
+    lambda: block_cache.hit_ratio,
+)
+registry.gauge(
+    "page_cache_hit_ratio",
+    "Pages served from the page cache",
+    lambda: page_cache.hit_ratio,
+)
+registry.gauge(
+    "transcodes_running", "Renditions being encoded", lambda: transcoder.running
+)
+
+# Mount static files, fingerprinted ones are immutable and precompressed;
+# the media library below static_path is only reachable through /player/stream
 app.mount(
-    "/static", StaticFiles(directory=get_app_settings().static_path), name="static"
+    "/static",
+    AssetFiles(assets, settings.static_path, excluded=[settings.movies_path]),
+    name="static",
 )
 
 # register routers
 app.include_router(player_router, prefix="/player")
 app.include_router(titles_router, prefix="/titles")
+app.include_router(api_router, prefix="/api")
 
 
 # home page
 @app.get("/", response_class=HTMLResponse, name="home")
-async def home(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+def home(request: Request):
+    return page_cache.respond(
+        request,
+        lambda: templates.TemplateResponse("index.html", {"request": request}),
+    )
@@ -0,0 +1,299 @@
+"""
+Metrics
+
+A small in-process registry rendered in the Prometheus text format, and a
+pure ASGI middleware that records every request into it and serves it on
+`/metrics`. Recording is a dict lookup and an addition; nothing is formatted
+until a scrape.
+
+Per request the middleware records
+- latency per route template, method and status
+- response bytes per route, and per episode when the route sets
+  `request.state.metrics_episode`
+- with `count_queries`, how many SQL statements the request ran and how long
+  they took, added up in the `request_stats` context variable by whatever
+  runs the statements (see yagizflix's app.sql_metrics), so a route that lazy
+  loads a relationship per row stands out by its query count
+
+Gauges can be backed by a function that is only called on a scrape, that is
+how stream counts and cache hit ratios are exposed.
+
+This module is vendored unchanged into yagizflix and home-media-server and
+must not import anything beyond the standard library and Starlette; a test
+in yagizflix fails when the two copies differ.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from collections.abc import Callable
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def header(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        function: Callable[[], float] | None = None,
+    ):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value: float, labels: tuple = ()) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self) -> list[str]:
+        if self.function is not None:
+            self.set(self.function())
+        return super().render()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, labels: tuple = ()) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # a count per bucket plus +Inf, then the sum
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        with self._lock:
+            values = [(labels, list(series)) for labels, series in self._values.items()]
+        names = (*self.labels, "le")
+        for label_values, series in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                labels = format_labels(names, (*label_values, bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self, name: str, documentation: str, labels: tuple[str, ...] = ()
+    ) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        function: Callable[[], float] | None = None,
+    ) -> Gauge:
+        return self.register(Gauge(name, documentation, function=function))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> bytes:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return ("\n".join(lines) + "\n").encode()
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    "http_request_duration_seconds",
+    "Time from receiving a request to the end of its response",
+    ("method", "route", "status"),
+)
+response_bytes = registry.counter(
+    "http_response_bytes_total", "Response body bytes sent", ("route",)
+)
+episode_bytes = registry.counter(
+    "stream_episode_bytes_total", "Video bytes sent per episode", ("episode",)
+)
+# registered by the middleware with `count_queries`
+request_queries = Histogram(
+    "db_queries_per_request",
+    "SQL statements run by one request",
+    ("route",),
+    QUERY_BUCKETS,
+)
+request_query_seconds = Histogram(
+    "db_query_seconds_per_request",
+    "Time one request spent in SQL statements",
+    ("route",),
+)
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    query_seconds: float = 0.0
+
+
+# the stats of the request being handled, threadpool calls run in a copy of the
+# context so sync dependencies and routes count towards it as well
+request_stats: ContextVar[RequestStats | None] = ContextVar(
+    "request_stats", default=None
+)
+
+
+class MetricsMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        registry: Registry = registry,
+        path: str = "/metrics",
+        count_queries: bool = False,
+    ) -> None:
+        self.app = app
+        self.registry = registry
+        self.path = path
+        self.count_queries = count_queries
+        if count_queries:
+            registry.register(request_queries)
+            registry.register(request_query_seconds)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if scope["path"] == self.path:
+            await self.serve(send)
+            return
+
+        stats = RequestStats() if self.count_queries else None
+        token = request_stats.set(stats)
+        status = 500
+        sent = 0
+        started = time.perf_counter()
+
+        async def send_and_count(message) -> None:
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            elif message["type"] == "http.response.zerocopysend":
+                sent += message.get("count") or 0
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_count)
+        finally:
+            request_stats.reset(token)
+            # the router leaves the matched route in the scope, its path template
+            # keeps the label set small; mounts like /static only leave their root
+            route = scope.get("route")
+            if route is not None:
+                route = route.path
+            else:
+                route = scope.get("root_path") or "unmatched"
+            request_duration.observe(
+                time.perf_counter() - started, (scope["method"], route, status)
+            )
+            response_bytes.inc((route,), sent)
+            if stats is not None:
+                request_queries.observe(stats.queries, (route,))
+                request_query_seconds.observe(stats.query_seconds, (route,))
+            episode = scope.get("state", {}).get("metrics_episode")
+            if episode is not None:
+                episode_bytes.inc((episode,), sent)
+
+    async def serve(self, send: Send) -> None:
+        body = self.registry.render()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/plain; version=0.0.4; charset=utf-8"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"cache-control", b"no-store"),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
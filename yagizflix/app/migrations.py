@@ -0,0 +1,156 @@
+"""
+Schema migrations
+
+`PRAGMA user_version` holds how many entries of `MIGRATIONS` a database has
+had applied. `migrate` runs the missing ones in order and stamps the version
+after each, so a start with an up to date database costs a single pragma read.
+
+A new database gets the current models through `create_all` and is stamped
+with the latest version right away, migrations only bring existing databases
+up to what the models declare. So a schema change goes into the models *and*
+gets a migration appended here, never edited in place. Migrations have to be
+idempotent (IF NOT EXISTS and friends): SQLite commits DDL as it runs, a
+migration interrupted halfway is simply run again.
+"""
+
+from collections.abc import Callable
+
+from sqlalchemy import Engine, inspect
+from sqlmodel import SQLModel
+
+from .search import create_search_index
+
+# titletagslink.title_name copies title.name for ix_titletagslink_tag_id_title_name
+LINK_TRIGGERS = {
+    "titletagslink_title_name_insert": (
+        "AFTER INSERT ON titletagslink WHEN NEW.title_name IS NULL",
+        "UPDATE titletagslink SET title_name = "
+        "(SELECT name FROM title WHERE id = NEW.title_id) "
+        "WHERE title_id = NEW.title_id AND tag_id = NEW.tag_id;",
+    ),
+    "titletagslink_title_name_update": (
+        "AFTER UPDATE OF name ON title",
+        "UPDATE titletagslink SET title_name = NEW.name WHERE title_id = NEW.id;",
+    ),
+}
+
+
+def create_link_triggers(engine: Engine) -> None:
+    with engine.begin() as connection:
+        for name, (event, body) in LINK_TRIGGERS.items():
+            connection.exec_driver_sql(
+                f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END"
+            )
+
+
+def create_schema(engine: Engine) -> None:
+    SQLModel.metadata.create_all(engine)
+    create_search_index(engine)
+    create_link_triggers(engine)
+
+
+def baseline(engine: Engine) -> None:
+    """databases from before versioning, whatever they miss of the first schema"""
+    create_schema(engine)
+    # create_all only adds indexes along with new tables; one on a column that a
+    # later migration adds comes with that migration
+    for table in SQLModel.metadata.sorted_tables:
+        columns = {column["name"] for column in inspect(engine).get_columns(table.name)}
+        for index in table.indexes:
+            if {column.name for column in index.columns} <= columns:
+                index.create(engine, checkfirst=True)
+
+
+def index_tag_links(engine: Engine) -> None:
+    """titles of a tag, the primary key only serves title_id first lookups"""
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_titletagslink_tag_id_title_id "
+            "ON titletagslink (tag_id, title_id)"
+        )
+
+
+def transcode_jobs(engine: Engine) -> None:
+    """the rendition queue, see app.renditions"""
+    SQLModel.metadata.tables["transcodejob"].create(engine, checkfirst=True)
+
+
+def link_title_names(engine: Engine) -> None:
+    """titles of a tag by name without sorting them, replaces (tag_id, title_id)"""
+    columns = {column["name"] for column in inspect(engine).get_columns("titletagslink")}
+    with engine.begin() as connection:
+        if "title_name" not in columns:
+            connection.exec_driver_sql(
+                "ALTER TABLE titletagslink ADD COLUMN title_name VARCHAR"
+            )
+        connection.exec_driver_sql(
+            "UPDATE titletagslink SET title_name = "
+            "(SELECT name FROM title WHERE id = titletagslink.title_id)"
+        )
+        connection.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_titletagslink_tag_id_title_name "
+            "ON titletagslink (tag_id, title_name, title_id)"
+        )
+        connection.exec_driver_sql("DROP INDEX IF EXISTS ix_titletagslink_tag_id_title_id")
+    create_link_triggers(engine)
+
+
+def index_episode_names(engine: Engine) -> None:
+    """scans and renames find episodes by file path"""
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_episode_name ON episode (name)"
+        )
+
+
+MIGRATIONS: list[Callable[[Engine], None]] = [
+    baseline,
+    index_tag_links,
+    transcode_jobs,
+    link_title_names,
+    index_episode_names,
+]
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def schema_version(engine: Engine) -> int:
+    with engine.connect() as connection:
+        return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def stamp(engine: Engine, version: int) -> None:
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+def migrate(engine: Engine) -> list[str]:
+    """bring the database up to LATEST_VERSION, returns the migrations run"""
+    version = schema_version(engine)
+    if version == LATEST_VERSION:
+        return []
+    if version > LATEST_VERSION:
+        raise RuntimeError(
+            f"database schema version {version} is newer than this app's "
+            f"{LATEST_VERSION}"
+        )
+
+    if version == 0 and not inspect(engine).get_table_names():
+        create_schema(engine)
+        stamp(engine, LATEST_VERSION)
+        return [create_schema.__name__]
+
+    applied = []
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(engine)
+        stamp(engine, number)
+        applied.append(migration.__name__)
+    return applied
+
+
+if __name__ == "__main__":
+    from app.database import engine
+
+    before = schema_version(engine)
+    for name in migrate(engine):
+        print(f"applied {name}")
+    print(f"schema version {before} -> {schema_version(engine)}")
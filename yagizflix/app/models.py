@@ -12,17 +12,29 @@ Desired features:
 from datetime import datetime
 from typing import Optional
 
+from sqlalchemy import Index
 from sqlmodel import Field, Relationship, SQLModel
 
 
 class TitleTagsLink(SQLModel, table=True):
+    # titles of a tag in keyset order, the primary key is title_id first
+    __table_args__ = (
+        Index("ix_titletagslink_tag_id_title_name", "tag_id", "title_name", "title_id"),
+    )
+
     title_id: Optional[int] = Field(
         default=None, foreign_key="title.id", primary_key=True
     )
     tag_id: Optional[int] = Field(default=None, foreign_key="tag.id", primary_key=True)
+    # the title's name, kept current by triggers (see app.migrations) so a tag's
+    # titles come out of the index already sorted
+    title_name: Optional[str] = None
 
 
 class Title(SQLModel, table=True):
+    # keyset pagination by name, see app.pagination
+    __table_args__ = (Index("ix_title_name_id", "name", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(default="title name")
     watch_later: bool = Field(default=False)
@@ -38,13 +50,19 @@ class Title(SQLModel, table=True):
 class Episode(SQLModel, table=True):
     """handles both series episodes and movies"""
 
+    # season/episode navigation within a title, see app.navigation
+    __table_args__ = (
+        Index("ix_episode_title_season_episode", "title_id", "season", "episode_number"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
 
     # the title that the episode belongs to
     title_id: int = Field(foreign_key="title.id")
     title: Title = Relationship(back_populates="episodes")
 
-    name: str = Field(default="episode name")
+    # the file's path in the library, which scans and renames look episodes up by
+    name: str = Field(default="episode name", index=True)
 
     # for previous and next navigation - or prequel and sequel
     previous_id: Optional[int] = Field(default=None, foreign_key="episode.id")
@@ -70,8 +88,15 @@ class Episode(SQLModel, table=True):
     completed: bool = Field(default=False)
     left_at: Optional[int] = Field(default=None, gt=0)
 
+    # duration, bitrate and layout of the file, see app.probe
+    probe: Optional["MediaProbe"] = Relationship(
+        back_populates="episode", sa_relationship_kwargs={"uselist": False}
+    )
+
 
 class Tag(SQLModel, table=True):
+    __table_args__ = (Index("ix_tag_name_id", "name", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(default="tag name")
     description: str = Field(default="tag description")
@@ -79,3 +104,52 @@ class Tag(SQLModel, table=True):
     titles: list["Title"] = Relationship(
         back_populates="tags", link_model=TitleTagsLink
     )
+
+
+class MediaFile(SQLModel, table=True):
+    """fingerprint of a scanned file, lets rescans skip everything unchanged"""
+
+    # relative to the media root, without the .mp4 suffix it's the episode name
+    path: str = Field(primary_key=True)
+    size: int
+    mtime_ns: int
+    episode_id: Optional[int] = Field(default=None, foreign_key="episode.id", index=True)
+
+
+class MediaProbe(SQLModel, table=True):
+    """facts read from an MP4's header atoms, valid while mtime and size match"""
+
+    path: str = Field(primary_key=True)
+    mtime_ns: int
+    size: int
+    episode_id: Optional[int] = Field(default=None, foreign_key="episode.id", index=True)
+    episode: Optional[Episode] = Relationship(back_populates="probe")
+
+    duration: Optional[float] = None  # seconds
+    bitrate: Optional[int] = None  # bits/s, averaged over the whole file
+    moov_at_front: bool = False
+
+
+class Artwork(SQLModel, table=True):
+    """poster and sprite images of an episode, stored by digest, see app.artwork"""
+
+    episode_id: int = Field(foreign_key="episode.id", primary_key=True)
+    kind: str = Field(primary_key=True)  # "poster" or "sprite"
+    source_mtime_ns: int  # of the file the image was made from
+    digest: str  # sha256 of the image bytes
+
+
+class TranscodeJob(SQLModel, table=True):
+    """a lower bitrate rendition of an episode and how far along it is, see app.renditions"""
+
+    # the queue takes the oldest queued job first
+    __table_args__ = (Index("ix_transcodejob_state_queued_at", "state", "queued_at"),)
+
+    episode_id: int = Field(foreign_key="episode.id", primary_key=True)
+    rendition: str = Field(primary_key=True)  # a name from app.renditions.LADDER
+    bitrate: int  # bits/s, video and audio together
+    source_mtime_ns: int  # of the file the rendition is made from
+    state: str = Field(default="queued")  # queued, running, done or failed
+    attempts: int = Field(default=0)
+    error: Optional[str] = None
+    queued_at: datetime = Field(default_factory=datetime.now)
@@ -0,0 +1,120 @@
+"""
+Season/episode navigation
+
+Episodes are ordered by (season, episode_number) within a title, which the
+composite index on episode covers. One query per title loads the whole
+ordering with each episode's neighbours computed by LAG/LEAD, and the result
+is cached until an episode of that title is written. The player and the title
+page share it, so next/previous is a dict lookup instead of lazy loading the
+`previous`/`next` relationships; those stay as an optional consistency layer.
+"""
+
+import threading
+from dataclasses import dataclass
+
+from sqlalchemy import event, func
+from sqlalchemy.orm.attributes import get_history
+from sqlmodel import Session, select
+
+from .models import Episode
+from .page_cache import catalogue_generation
+
+
+@dataclass(frozen=True)
+class EpisodeSummary:
+    id: int
+    name: str
+    season: int
+    episode_number: int
+    previous_id: int | None
+    next_id: int | None
+
+
+class TitleEpisodes:
+    def __init__(self, episodes: list[EpisodeSummary]) -> None:
+        self.episodes = episodes
+        self._by_id = {episode.id: episode for episode in episodes}
+
+    def get(self, episode_id: int) -> EpisodeSummary | None:
+        return self._by_id.get(episode_id)
+
+    def neighbours(self, episode_id: int) -> tuple[int | None, int | None]:
+        episode = self._by_id.get(episode_id)
+        if episode is None:
+            return None, None
+        return episode.previous_id, episode.next_id
+
+    def seasons(self) -> dict[int, list[EpisodeSummary]]:
+        seasons: dict[int, list[EpisodeSummary]] = {}
+        for episode in self.episodes:
+            seasons.setdefault(episode.season, []).append(episode)
+        return seasons
+
+
+def load_title_episodes(session: Session, title_id: int) -> TitleEpisodes:
+    order = (Episode.season, Episode.episode_number, Episode.id)
+    query = (
+        select(
+            Episode.id,
+            Episode.name,
+            Episode.season,
+            Episode.episode_number,
+            func.lag(Episode.id).over(order_by=order),
+            func.lead(Episode.id).over(order_by=order),
+        )
+        .where(Episode.title_id == title_id)
+        .order_by(*order)
+    )
+    return TitleEpisodes([EpisodeSummary(*row) for row in session.exec(query)])
+
+
+class EpisodeOrderCache:
+    def __init__(self) -> None:
+        self._titles: dict[int, TitleEpisodes] = {}
+        self._lock = threading.Lock()
+        self._generation = catalogue_generation.value
+
+    def get(self, session: Session, title_id: int) -> TitleEpisodes:
+        # another worker changed the catalogue, its ORM events never reach us
+        generation = catalogue_generation.value
+        if generation != self._generation:
+            self.clear()
+            self._generation = generation
+        title_episodes = self._titles.get(title_id)
+        if title_episodes is None:
+            title_episodes = load_title_episodes(session, title_id)
+            with self._lock:
+                self._titles[title_id] = title_episodes
+        return title_episodes
+
+    def invalidate(self, title_id: int) -> None:
+        with self._lock:
+            self._titles.pop(title_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._titles.clear()
+
+
+episode_orders = EpisodeOrderCache()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_titles(session, flush_context):
+    changed = session.info.setdefault("episode_order_titles", set())
+    for instance in [*session.new, *session.dirty, *session.deleted]:
+        if isinstance(instance, Episode):
+            changed.add(instance.title_id)
+            # moved to another title, the old one changes as well
+            changed.update(get_history(instance, "title_id").deleted or ())
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_titles(session):
+    for title_id in session.info.pop("episode_order_titles", ()):
+        episode_orders.invalidate(title_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_titles(session):
+    session.info.pop("episode_order_titles", None)
@@ -0,0 +1,144 @@
+"""
+HLS packaging for episodes
+
+Cuts an episode into fixed-duration fMP4 segments plus a VOD playlist with
+ffmpeg, stream copy only, so packaging costs about as much as copying the file.
+
+Output goes to `{hls_path}/{episode_id}/{version}/`, where version is derived
+from the source file's size and mtime. A version directory is never rewritten,
+so everything in it can be cached forever; replacing the source file simply
+produces a new version.
+
+Run `python -m app.packaging` to package every episode ahead of time.
+"""
+
+import asyncio
+import hashlib
+import logging
+import shutil
+from pathlib import Path
+
+import anyio
+
+logger = logging.getLogger(__name__)
+
+PLAYLIST_NAME = "index.m3u8"
+INIT_NAME = "init.mp4"
+
+CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+}
+
+
+def source_version(source: Path) -> str:
+    stat_result = source.stat()
+    fingerprint = f"{stat_result.st_size}-{stat_result.st_mtime_ns}"
+    return hashlib.sha1(fingerprint.encode()).hexdigest()[:16]
+
+
+class Packager:
+    def __init__(
+        self,
+        output_path: Path,
+        segment_duration: int = 6,
+        ffmpeg: str = "ffmpeg",
+        max_jobs: int = 1,
+    ) -> None:
+        self.output_path = output_path
+        self.segment_duration = segment_duration
+        self.ffmpeg = ffmpeg
+        self.max_jobs = max_jobs
+        self._jobs: dict[tuple[int, str], asyncio.Task] = {}
+        self._slots: asyncio.Semaphore | None = None
+
+    def version_path(self, episode_id: int, version: str) -> Path:
+        return self.output_path / str(episode_id) / version
+
+    def packaged_version(self, episode_id: int, source: Path) -> str | None:
+        """the current version if it is fully packaged, else None"""
+        version = source_version(source)
+        playlist = self.version_path(episode_id, version) / PLAYLIST_NAME
+        return version if playlist.is_file() else None
+
+    def schedule(self, episode_id: int, source: Path) -> None:
+        """package in the background, at most once per episode version"""
+        key = (episode_id, source_version(source))
+        if key in self._jobs:
+            return
+        task = asyncio.create_task(self.package(episode_id, source))
+        self._jobs[key] = task
+        task.add_done_callback(lambda task: self._finished(key, task))
+
+    def _finished(self, key: tuple[int, str], task: asyncio.Task) -> None:
+        self._jobs.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("packaging episode %s failed", key[0], exc_info=task.exception())
+
+    async def package(self, episode_id: int, source: Path) -> Path:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_jobs)
+
+        async with self._slots:
+            target = self.version_path(episode_id, source_version(source))
+            if (target / PLAYLIST_NAME).is_file():
+                return target
+
+            # write into a scratch directory and rename, so a half-written
+            # version is never visible to the routes
+            scratch = target.with_name(f".{target.name}.tmp")
+            shutil.rmtree(scratch, ignore_errors=True)
+            scratch.mkdir(parents=True)
+            try:
+                await anyio.run_process(self.command(source, scratch))
+                scratch.rename(target)
+            finally:
+                shutil.rmtree(scratch, ignore_errors=True)
+            return target
+
+    def command(self, source: Path, target: Path) -> list[str]:
+        # with stream copy ffmpeg can only cut on keyframes, segments are
+        # segment_duration long give or take one GOP
+        return [
+            self.ffmpeg,
+            "-nostdin",
+            "-loglevel", "error",
+            "-i", str(source),
+            "-map", "0:v:0",
+            "-map", "0:a?",
+            "-c", "copy",
+            "-f", "hls",
+            "-hls_time", str(self.segment_duration),
+            "-hls_playlist_type", "vod",
+            "-hls_segment_type", "fmp4",
+            "-hls_fmp4_init_filename", INIT_NAME,
+            "-hls_segment_filename", str(target / "segment_%05d.m4s"),
+            str(target / PLAYLIST_NAME),
+        ]  # fmt: skip
+
+
+if __name__ == "__main__":
+    from sqlmodel import Session, select
+
+    from app.config import get_app_settings
+    from app.database import engine
+    from app.models import Episode
+
+    settings = get_app_settings()
+    packager = Packager(
+        settings.hls_path,
+        segment_duration=settings.hls_segment_duration,
+        ffmpeg=settings.ffmpeg_path,
+    )
+    with Session(engine) as session:
+        episodes = session.exec(select(Episode)).all()
+
+    async def package_all():
+        for episode in episodes:
+            source = settings.movies_path / f"{episode.name}.mp4"
+            if source.is_file():
+                target = await packager.package(episode.id, source)
+                print(f"{episode.name} -> {target}")
+
+    anyio.run(package_all)
@@ -0,0 +1,224 @@
+"""
+Rendered page cache
+
+Browse pages only change when the catalogue does, so they are rendered once
+and kept in memory together with their gzip (and brotli, when the `brotli`
+package is installed) encodings and an ETag. Entries are keyed on the URL and
+stamped with the catalogue generation they were rendered at; any committed
+write to a Title, Tag, Episode or their links bumps the generation, which makes
+every older entry stale at once and empties the cache.
+
+Only the query parameters a route names are part of the key, a URL carrying
+any other is rendered but not cached, so made-up query strings can't fill it.
+
+With several workers the generation is shared between them and pages also go
+to a disk tier they all read, see app.shared.
+
+Clients revalidate with If-None-Match (Cache-Control: no-cache) and get a 304
+while the catalogue is unchanged.
+
+The player page is not cached, it carries the viewer's position which changes
+every few seconds.
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from urllib.parse import urlencode
+
+from fastapi.requests import Request
+from fastapi.responses import Response
+from sqlalchemy import event
+from sqlmodel import Session
+
+from .models import Episode, Tag, Title, TitleTagsLink
+from .shared import DiskStore, SharedCounter
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - gzip only
+    brotli = None
+
+CATALOGUE_MODELS = (Title, Tag, Episode, TitleTagsLink)
+
+
+class CatalogueGeneration:
+    def __init__(self) -> None:
+        self._value = 0
+        self._lock = threading.Lock()
+        self.shared: SharedCounter | None = None
+        # called after every bump, caches drop what it made stale
+        self.listeners: list[Callable[[], None]] = []
+
+    @property
+    def value(self) -> int:
+        return self._value if self.shared is None else self.shared.value
+
+    def bump(self) -> None:
+        if self.shared is not None:
+            self.shared.bump()
+        else:
+            with self._lock:
+                self._value += 1
+        for listener in self.listeners:
+            listener()
+
+
+@dataclass(frozen=True)
+class CachedPage:
+    generation: int
+    etag: str
+    media_type: str | None
+    bodies: dict[str, bytes]  # content-coding to body, "identity" always present
+
+
+def encode(body: bytes) -> dict[str, bytes]:
+    bodies = {"identity": body, "gzip": gzip.compress(body, compresslevel=6)}
+    if brotli is not None:
+        bodies["br"] = brotli.compress(body, quality=5)
+    return bodies
+
+
+def accepted_encodings(request: Request) -> set[str]:
+    accepted = set()
+    for item in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") not in ("q=0", "q=0.0"):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class PageCache:
+    def __init__(self, generation: CatalogueGeneration, max_entries: int = 1024) -> None:
+        self.generation = generation
+        self.max_entries = max_entries
+        self._pages: OrderedDict[str, CachedPage] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # pages rendered by other workers, see app.shared
+        self.disk: DiskStore | None = None
+        generation.listeners.append(self.evict)
+
+    def respond(
+        self,
+        request: Request,
+        render: Callable[[], Response],
+        params: Sequence[str] = (),
+    ) -> Response:
+        """
+        the cached page for this URL, rendering it if it is missing or stale;
+        `params` are the query parameters the page depends on. A miss renders,
+        compresses and maybe writes to disk, so call it from sync routes, which
+        run in the threadpool
+        """
+        if any(name not in params for name in request.query_params):
+            return render()
+        query = urlencode(sorted(request.query_params.multi_items()))
+        key = str(request.url.replace(query=query))
+        page = self.get(key)
+        if page is None:
+            # stamped with the generation from before rendering, a write that
+            # lands meanwhile leaves the page stale instead of cached for good
+            generation = self.generation.value
+            response = render()
+            if response.status_code != 200:
+                return response
+            page = self.store(key, response, generation)
+
+        headers = {
+            "ETag": page.etag,
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if page.etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+
+        accepted = accepted_encodings(request)
+        coding = next(
+            (c for c in ("br", "gzip") if c in page.bodies and c in accepted), "identity"
+        )
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        return Response(page.bodies[coding], headers=headers, media_type=page.media_type)
+
+    def get(self, key: str) -> CachedPage | None:
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None and page.generation != self.generation.value:
+                del self._pages[key]
+                page = None
+            if page is not None:
+                self.hits += 1
+                self._pages.move_to_end(key)
+                return page
+
+        page = self.disk.get(key) if self.disk is not None else None
+        if page is None or page.generation != self.generation.value:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._remember(key, page)
+        return page
+
+    def store(self, key: str, response: Response, generation: int) -> CachedPage:
+        body = bytes(response.body)
+        page = CachedPage(
+            generation,
+            f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"',
+            response.headers.get("content-type"),
+            encode(body),
+        )
+        self._remember(key, page)
+        if self.disk is not None:
+            self.disk.put(key, page)
+        return page
+
+    def _remember(self, key: str, page: CachedPage) -> None:
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pages.clear()
+
+    def evict(self) -> None:
+        """after a bump every stored page is stale"""
+        self.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+catalogue_generation = CatalogueGeneration()
+page_cache = PageCache(catalogue_generation)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_catalogue_writes(session, flush_context):
+    if any(
+        isinstance(instance, CATALOGUE_MODELS)
+        for instance in [*session.new, *session.dirty, *session.deleted]
+    ):
+        session.info["catalogue_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_generation(session):
+    if session.info.pop("catalogue_changed", False):
+        catalogue_generation.bump()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_catalogue_writes(session):
+    session.info.pop("catalogue_changed", None)
@@ -0,0 +1,90 @@
+"""
+Keyset pagination
+
+Pages are addressed by the sort key of their last row instead of an OFFSET,
+`WHERE (name, id) > (:name, :id) ORDER BY name, id LIMIT n` seeks straight into
+an index on those columns, so page 1000 costs the same as page 1 and rows
+written meanwhile don't shift pages around.
+
+The cursor handed to clients is that sort key, JSON encoded in urlsafe base64;
+it's opaque to them and validated on the way back in, every value has to have
+the Python type of its sort column.
+"""
+
+import base64
+import binascii
+import json
+
+from fastapi import HTTPException
+from sqlalchemy import Select, TypeDecorator, tuple_
+from sqlmodel import Session
+
+
+def encode_cursor(key: tuple) -> str:
+    raw = json.dumps(list(key), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, types: tuple[type, ...]) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = json.loads(raw)
+    except (binascii.Error, ValueError):
+        key = None
+    # exact types, a bool is an int to isinstance
+    if (
+        not isinstance(key, list)
+        or len(key) != len(types)
+        or any(type(value) is not kind for value, kind in zip(key, types))
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return key
+
+
+def python_type(column) -> type:
+    kind = column.type
+    # sqlmodel's AutoString decorates String, only the latter has a python_type
+    if isinstance(kind, TypeDecorator):
+        kind = kind.impl_instance
+    return kind.python_type
+
+
+def parse_fields(fields: str | None, allowed: tuple[str, ...]) -> list[str]:
+    """requested fields in `allowed` order, all of them when none are given"""
+    if not fields:
+        return list(allowed)
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+        )
+    return [field for field in allowed if field in requested]
+
+
+def keyset_page(
+    session: Session,
+    query: Select,
+    order: tuple,
+    columns: dict,
+    fields: list[str],
+    after: str | None,
+    limit: int,
+) -> dict:
+    """
+    one page of `query` ordered by the `order` columns, with only `fields` of
+    `columns` selected; returns the rows and the cursor of the next page
+    """
+    if after is not None:
+        types = tuple(python_type(column) for column in order)
+        query = query.where(tuple_(*order) > tuple_(*decode_cursor(after, types)))
+    # one extra row tells whether another page follows
+    selected = [columns[field] for field in fields]
+    query = query.with_only_columns(*selected, *order).order_by(*order).limit(limit + 1)
+    rows = session.execute(query).all()
+
+    items = [dict(zip(fields, row[: len(fields)])) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(tuple(rows[limit - 1][len(fields) :]))
+    return {"items": items, "next": next_cursor}
@@ -0,0 +1,155 @@
+"""
+MP4 metadata probe
+
+Reads only box headers (and the small `mvhd` box) of an MP4 file to find its
+duration, average bitrate and whether the `moov` atom comes before `mdat`
+("faststart"). Results are stored in the `mediaprobe` table keyed by path and
+checked against the file's mtime/size, so a file is probed once, not on every
+request.
+"""
+
+import struct
+from collections.abc import Iterator
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+from sqlalchemy import Engine
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session
+
+from .models import MediaProbe
+
+
+@dataclass(frozen=True)
+class Box:
+    type: bytes
+    offset: int
+    header_size: int
+    size: int
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+    @property
+    def payload_offset(self) -> int:
+        return self.offset + self.header_size
+
+
+@dataclass(frozen=True)
+class ProbeResult:
+    size: int
+    duration: float | None
+    bitrate: int | None
+    moov_offset: int | None
+    mdat_offset: int | None
+
+    @property
+    def moov_at_front(self) -> bool:
+        if self.moov_offset is None:
+            return False
+        return self.mdat_offset is None or self.moov_offset < self.mdat_offset
+
+
+def iter_boxes(file: BinaryIO, start: int, end: int) -> Iterator[Box]:
+    """boxes between `start` and `end`, reading nothing but their headers"""
+    offset = start
+    while offset + 8 <= end:
+        file.seek(offset)
+        header = file.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            largesize = file.read(8)
+            if len(largesize) < 8:
+                return
+            (size,) = struct.unpack(">Q", largesize)
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return  # corrupt, stop rather than loop forever
+        yield Box(box_type, offset, header_size, size)
+        offset += size
+
+
+def read_mvhd(file: BinaryIO, box: Box) -> float | None:
+    """movie duration in seconds from an mvhd box"""
+    file.seek(box.payload_offset)
+    version = file.read(4)[:1]
+    if version == b"\x01":
+        data = file.read(28)
+        if len(data) < 28:
+            return None
+        _, _, timescale, duration = struct.unpack(">QQIQ", data)
+    else:
+        data = file.read(16)
+        if len(data) < 16:
+            return None
+        _, _, timescale, duration = struct.unpack(">IIII", data)
+    return duration / timescale if timescale else None
+
+
+def probe_file(path: Path) -> ProbeResult:
+    size = path.stat().st_size
+    duration = moov_offset = mdat_offset = None
+    with open(path, "rb") as file:
+        for box in iter_boxes(file, 0, size):
+            if box.type == b"moov" and moov_offset is None:
+                moov_offset = box.offset
+                for child in iter_boxes(file, box.payload_offset, box.end):
+                    if child.type == b"mvhd":
+                        duration = read_mvhd(file, child)
+                        break
+            elif box.type == b"mdat" and mdat_offset is None:
+                mdat_offset = box.offset
+
+    bitrate = int(size * 8 / duration) if duration else None
+    return ProbeResult(size, duration, bitrate, moov_offset, mdat_offset)
+
+
+def probe_row(episode_id: int | None, path: Path) -> dict:
+    stat_result = path.stat()
+    result = probe_file(path)
+    return {
+        "path": str(path),
+        "mtime_ns": stat_result.st_mtime_ns,
+        "size": result.size,
+        "episode_id": episode_id,
+        "duration": result.duration,
+        "bitrate": result.bitrate,
+        "moov_at_front": result.moov_at_front,
+    }
+
+
+def save_probes(session: Session, rows: list[dict]) -> None:
+    statement = sqlite_insert(MediaProbe)
+    columns = ("mtime_ns", "size", "episode_id", "duration", "bitrate", "moov_at_front")
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[MediaProbe.path],
+            set_={column: statement.excluded[column] for column in columns},
+        ),
+        rows,
+    )
+
+
+def is_current(probe: MediaProbe | None, path: Path) -> bool:
+    if probe is None:
+        return False
+    stat_result = path.stat()
+    return (probe.mtime_ns, probe.size) == (stat_result.st_mtime_ns, stat_result.st_size)
+
+
+def ensure_probe(engine: Engine, episode_id: int, path: Path) -> MediaProbe:
+    """the stored probe for `path`, probing it first if it is missing or stale"""
+    with Session(engine, expire_on_commit=False) as session:
+        probe = session.get(MediaProbe, str(path))
+        if is_current(probe, path):
+            return probe
+        save_probes(session, [probe_row(episode_id, path)])
+        session.commit()
+        return session.get(MediaProbe, str(path), populate_existing=True)
@@ -0,0 +1,89 @@
+"""
+Watch progress buffering
+
+Players send a heartbeat every few seconds. Heartbeats only overwrite the
+latest position per episode in memory, and a background task writes whatever
+changed in one transaction every `progress_flush_interval` seconds, so SQLite
+sees one write per interval no matter how many viewers there are.
+
+With several workers only the leader writes; the others hand their batch to
+the shared spool, which the leader drains into its own, see app.shared.
+"""
+
+import logging
+import threading
+
+import anyio
+from sqlalchemy import Engine, bindparam, update
+
+from .models import Episode
+from .shared import LeaderLock, ProgressSpool
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressBuffer:
+    def __init__(self, engine: Engine, interval: float = 10.0) -> None:
+        self.engine = engine
+        self.interval = interval
+        self._pending: dict[int, dict] = {}
+        self._lock = threading.Lock()
+        self.spool: ProgressSpool | None = None
+        self.leader: LeaderLock | None = None
+
+    def record(self, episode_id: int, position: int, completed: bool = False) -> None:
+        with self._lock:
+            self._pending[episode_id] = {
+                "id": episode_id,
+                # left_at must be positive, the start of the episode is "not started"
+                "left_at": position or None,
+                "completed": completed,
+            }
+
+    def pending_position(self, episode_id: int) -> int | None:
+        with self._lock:
+            pending = self._pending.get(episode_id)
+        return pending["left_at"] if pending else None
+
+    def flush(self) -> int:
+        """write all pending positions in one transaction, returns how many"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if self.spool is not None:
+            if not self.leader.is_leader:
+                if pending:
+                    self.spool.append(list(pending.values()))
+                return 0
+            # ours are the newest, spooled rows were written before this flush
+            spooled = self.spool.drain()
+            pending = spooled | pending
+        if not pending:
+            return 0
+
+        episodes = Episode.__table__
+        # executemany UPDATE ... WHERE id = ? with every row in one go, a Core
+        # statement because the ORM one fails the batch when an episode was
+        # removed since its heartbeat, this one just matches nothing
+        statement = update(episodes).where(episodes.c.id == bindparam("episode_id"))
+        rows = [
+            {"episode_id": row["id"], "left_at": row["left_at"], "completed": row["completed"]}
+            for row in pending.values()
+        ]
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(statement, rows)
+        except Exception:
+            # put them back unless a newer heartbeat arrived meanwhile
+            with self._lock:
+                self._pending = pending | self._pending
+            raise
+        return len(pending)
+
+    async def run(self) -> None:
+        while True:
+            await anyio.sleep(self.interval)
+            try:
+                await anyio.to_thread.run_sync(self.flush)
+            except Exception:
+                logger.exception("flushing watch progress failed, retrying next interval")
@@ -0,0 +1,160 @@
+"""
+Query plan check
+
+`python -m app.query_plans` requests every catalogue page and API route
+in-process, streams an episode, fetches its HLS playlist and saves (and
+flushes) its progress unchanged, records the SQL all that sends, and runs
+EXPLAIN QUERY PLAN on each distinct statement with the parameters it was sent
+with. A full table scan
+(`SCAN <table>` without an index) or a sort of the whole result (`USE TEMP
+B-TREE FOR ORDER BY`, the index doesn't deliver the order) fails the check
+with a non-zero exit, so a route that loses its index breaks the build
+instead of slowing down with the catalogue. Scans of the FTS table are its
+own index and pass, and so does sorting its matches by rank.
+
+tests/test_query_plans.py runs the same check under pytest.
+
+Point DATABASE_URL at a copy of a real library to check realistic plans,
+the in-memory caches are cleared first so every route reaches the database.
+"""
+
+import re
+import sys
+
+from fastapi.testclient import TestClient
+from sqlalchemy import Engine, event, select
+
+from app.database import create_db_and_tables, engine, progress_buffer, read_engine
+from app.main import app
+from app.models import Episode, Tag
+from app.navigation import episode_orders
+from app.page_cache import page_cache
+
+FULL_SCAN = re.compile(r"\bSCAN (\w+)\b(?! USING (?:COVERING |INTEGER PRIMARY KEY )?INDEX)")
+TEMP_SORT = "USE TEMP B-TREE FOR ORDER BY"
+# FTS5, the virtual table is the index; CONSTANT ROW is a SELECT without FROM
+ALLOWED_SCANS = {"title_search", "CONSTANT"}
+# bm25 ranks are computed per match, they can't come out of an index
+RANKED = re.compile(r"\bSCAN title_search VIRTUAL TABLE\b")
+# statements that look rows up, inserts have no plan worth checking
+EXPLAINED = ("SELECT", "UPDATE", "DELETE")
+
+
+def routes(tag_id: int, title_id: int, episode_id: int) -> list[str]:
+    return [
+        "/",
+        "/titles/titles",
+        f"/titles/titles/{title_id}",
+        f"/titles/titles/{title_id}/poster",
+        "/titles/movies/search?q=the",
+        "/titles/suggest?q=the",
+        "/api/titles",
+        f"/api/titles?tag={tag_id}",
+        f"/api/titles?tag={tag_id}&watch_later=true&fields=id,name",
+        "/api/tags",
+        f"/api/episodes?title_id={title_id}",
+        f"/player/?q={episode_id}",
+        f"/player/stream?q={episode_id}",
+        f"/player/hls/{episode_id}/index.m3u8",
+    ]
+
+
+def exercise(client: TestClient, tag_id: int, title_id: int, episode_id: int) -> None:
+    """every route, then a heartbeat that leaves the episode's progress as it was"""
+    for url in routes(tag_id, title_id, episode_id):
+        client.get(url, follow_redirects=False, headers={"Range": "bytes=0-1023"})
+    with read_engine.connect() as connection:
+        left_at, completed = connection.execute(
+            select(Episode.left_at, Episode.completed).where(Episode.id == episode_id)
+        ).one()
+    client.post(
+        "/player/progress",
+        json={"episode_id": episode_id, "position": left_at or 0, "completed": completed},
+    )
+    progress_buffer.flush()
+
+
+def record_statements(engines: list[Engine], run) -> list[tuple[str, tuple]]:
+    statements = {}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith(EXPLAINED):
+            return
+        if executemany:
+            # one plan for every row
+            parameters = parameters[0] if parameters else ()
+        statements.setdefault((statement, tuple(parameters or ())), None)
+
+    for target in engines:
+        event.listen(target, "before_cursor_execute", before_cursor_execute)
+    try:
+        run()
+    finally:
+        for target in engines:
+            event.remove(target, "before_cursor_execute", before_cursor_execute)
+    return list(statements)
+
+
+def explain(statement: str, parameters: tuple) -> list[str]:
+    with read_engine.connect() as connection:
+        rows = connection.exec_driver_sql(
+            f"EXPLAIN QUERY PLAN {statement}", parameters
+        ).all()
+    return [row[-1] for row in rows]
+
+
+def full_scans(plan: list[str]) -> list[str]:
+    return [
+        line
+        for line in plan
+        for table in FULL_SCAN.findall(line)
+        if table not in ALLOWED_SCANS
+    ]
+
+
+def temp_sorts(plan: list[str]) -> list[str]:
+    if any(RANKED.search(line) for line in plan):
+        return []
+    return [line for line in plan if TEMP_SORT in line]
+
+
+def problems(plan: list[str]) -> list[str]:
+    return full_scans(plan) + temp_sorts(plan)
+
+
+def check() -> int:
+    create_db_and_tables()
+    page_cache.clear()
+    episode_orders.clear()
+
+    with read_engine.connect() as connection:
+        tag_id = connection.execute(select(Tag.id).limit(1)).scalar() or 1
+        first_episode = connection.execute(
+            select(Episode.id, Episode.title_id).limit(1)
+        ).first()
+    episode_id, title_id = first_episode or (1, 1)
+
+    client = TestClient(app)
+
+    def run():
+        exercise(client, tag_id, title_id, episode_id)
+
+    failures = 0
+    for statement, parameters in record_statements([engine, read_engine], run):
+        plan = explain(statement, parameters)
+        found = problems(plan)
+        failures += bool(found)
+        print(("SLOW " if found else "ok ") + " ".join(statement.split()))
+        for line in plan:
+            print(f"    {line}")
+    return failures
+
+
+if __name__ == "__main__":
+    failures = check()
+    print(
+        f"{failures} queries scan or sort a whole table"
+        if failures
+        else "no full scans or sorts"
+    )
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,42 @@
+"""
+Shared template environment
+
+One `Jinja2Templates` for the whole app instead of one per router, so every
+template is parsed and compiled once per process. Compiled templates also go
+to a `FileSystemBytecodeCache`, a restarted process loads them from there
+instead of compiling again; `python -m app.rendering` fills it ahead of time,
+e.g. while building a container image.
+
+Templates are named by their path below `templates_path`, like
+"titles/titles.html". Static files are linked with `asset_url`, see
+app.assets.
+"""
+
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from .assets import asset_url
+from .config import get_app_settings
+
+
+def create_templates() -> Jinja2Templates:
+    settings = get_app_settings()
+    settings.template_cache_path.mkdir(parents=True, exist_ok=True)
+    environment = Environment(
+        loader=FileSystemLoader(settings.templates_path),
+        bytecode_cache=FileSystemBytecodeCache(str(settings.template_cache_path)),
+        # without it a render doesn't stat the template file to look for changes
+        auto_reload=settings.templates_auto_reload,
+        autoescape=True,
+    )
+    environment.globals["asset_url"] = asset_url
+    return Jinja2Templates(env=environment)
+
+
+templates = create_templates()
+
+
+if __name__ == "__main__":
+    for name in templates.env.list_templates(extensions=["html"]):
+        templates.get_template(name)
+        print(f"compiled {name}")
@@ -0,0 +1,403 @@
+"""
+Rendition ladder and the transcoding queue
+
+Besides its original file every episode gets H.264/AAC renditions at the
+rungs of `LADDER` that are well below the original's bitrate, so a phone on a
+weak connection plays 600 kbit/s instead of whatever the file was mastered at.
+
+Jobs live in the `transcodejob` table, one row per episode and rung, queued
+by the player page when an episode is first viewed (or by
+`python -m app.renditions`, which also retries failed ones) and re-queued
+when its file changes. Only probed episodes get jobs, and only for rungs well
+below their measured bitrate. `TranscodeQueue.run` works through them with
+`workers` ffmpeg processes at most, each niced and limited to a few threads,
+and starts no new job while `busy()` says the server needs the CPU (the app
+pauses it at `transcode_pause_streams` playing streams), so transcoding only
+uses what serving leaves over. Jobs that were running when the process
+stopped are queued again on the next start.
+
+Outputs are `{renditions_path}/{episode_id}/{rendition}-{source mtime}.mp4`,
+faststart so they stream like any other episode file.
+
+Which rendition a viewer gets is decided per playback by `choose`: an
+explicit `rendition`, else the best one that fits the client's bandwidth with
+some headroom, taken from a `bandwidth` query parameter (bits/s, measured by
+the player) or the Downlink/Save-Data client hints. Without either the
+original is served.
+"""
+
+import logging
+import subprocess
+import sys
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+import anyio
+from sqlalchemy import Engine, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, select
+
+from .models import Episode, TranscodeJob
+
+logger = logging.getLogger(__name__)
+
+SOURCE = "source"
+# only pick a rendition whose bitrate leaves this share of the bandwidth spare
+HEADROOM = 0.8
+
+
+@dataclass(frozen=True)
+class Rendition:
+    name: str
+    height: int
+    video_bitrate: int  # bits/s
+    audio_bitrate: int  # bits/s
+
+    @property
+    def bitrate(self) -> int:
+        return self.video_bitrate + self.audio_bitrate
+
+
+LADDER = (
+    Rendition("1080p", 1080, 5_000_000, 160_000),
+    Rendition("720p", 720, 2_800_000, 128_000),
+    Rendition("480p", 480, 1_200_000, 96_000),
+    Rendition("360p", 360, 600_000, 64_000),
+)
+RENDITIONS = {rendition.name: rendition for rendition in LADDER}
+
+
+def ladder_for(source_bitrate: int | None) -> list[Rendition]:
+    """
+    rungs worth making, a rung close to the original saves next to nothing;
+    none without a measured bitrate, every rung might be above the original
+    """
+    if not source_bitrate:
+        return []
+    return [rung for rung in LADDER if rung.bitrate < source_bitrate * 0.75]
+
+
+def client_bandwidth(headers: Mapping[str, str], bandwidth: int | None) -> int | None:
+    """bits/s the client can take, None when it didn't say"""
+    if bandwidth is not None:
+        return bandwidth
+    if headers.get("save-data", "").lower() == "on":
+        return 0
+    try:
+        # Mbit/s, the browser's own estimate of recent throughput
+        return int(float(headers["downlink"]) * 1_000_000)
+    except (KeyError, ValueError):
+        return None
+
+
+def choose(options: dict[str, int], requested: str | None, bandwidth: int | None) -> str:
+    """
+    a rendition name out of `options` (name -> bits/s, `SOURCE` included):
+    the requested one, else the best that fits `bandwidth`, else the smallest
+    """
+    if requested in options:
+        return requested
+    if bandwidth is None or len(options) == 1:
+        return SOURCE
+    ranked = sorted((bitrate, name) for name, bitrate in options.items())
+    fitting = [name for bitrate, name in ranked if bitrate <= bandwidth * HEADROOM]
+    return fitting[-1] if fitting else ranked[0][1]
+
+
+def ffmpeg_command(
+    ffmpeg: str, source: Path, target: Path, rendition: Rendition, threads: int
+) -> list[str]:
+    # never upscale, a 720p file stays 720p in the 1080p rung at a lower bitrate
+    return [
+        ffmpeg, "-nostdin", "-loglevel", "error", "-y",
+        "-i", str(source),
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-vf", f"scale=-2:min({rendition.height}\\,ih)",
+        "-c:v", "libx264", "-preset", "veryfast", "-profile:v", "high",
+        "-b:v", str(rendition.video_bitrate),
+        "-maxrate", str(rendition.video_bitrate * 3 // 2),
+        "-bufsize", str(rendition.video_bitrate * 2),
+        "-c:a", "aac", "-ac", "2", "-b:a", str(rendition.audio_bitrate),
+        "-threads", str(threads),
+        "-movflags", "+faststart",
+        "-f", "mp4", str(target),
+    ]  # fmt: skip
+
+
+def enqueue(
+    engine: Engine, episode_id: int, source_mtime_ns: int, rungs: list[Rendition]
+) -> None:
+    """queue `rungs`, re-queueing jobs that were for an older version of the file"""
+    now = datetime.now()
+    statement = sqlite_insert(TranscodeJob).values(
+        [
+            {
+                "episode_id": episode_id,
+                "rendition": rung.name,
+                "bitrate": rung.bitrate,
+                "source_mtime_ns": source_mtime_ns,
+                "state": "queued",
+                "attempts": 0,
+                "queued_at": now,
+            }
+            for rung in rungs
+        ]
+    )
+    excluded = statement.excluded
+    with Session(engine) as session:
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=[TranscodeJob.episode_id, TranscodeJob.rendition],
+                set_={
+                    "bitrate": excluded.bitrate,
+                    "source_mtime_ns": excluded.source_mtime_ns,
+                    "state": excluded.state,
+                    "attempts": excluded.attempts,
+                    "error": None,
+                    "queued_at": excluded.queued_at,
+                },
+                where=TranscodeJob.source_mtime_ns != excluded.source_mtime_ns,
+            )
+        )
+        session.commit()
+
+
+def claim(engine: Engine) -> tuple[int, str, int, str] | None:
+    """
+    mark the oldest queued job running, returns its episode id, rendition,
+    source mtime and episode name; cheapest rungs of an episode come first
+    """
+    with Session(engine) as session:
+        while True:
+            row = session.exec(
+                select(
+                    TranscodeJob.episode_id,
+                    TranscodeJob.rendition,
+                    TranscodeJob.source_mtime_ns,
+                    Episode.name,
+                )
+                .join(Episode, Episode.id == TranscodeJob.episode_id)
+                .where(TranscodeJob.state == "queued")
+                .order_by(
+                    TranscodeJob.queued_at, TranscodeJob.episode_id, TranscodeJob.bitrate
+                )
+                .limit(1)
+            ).first()
+            if row is None:
+                return None
+            claimed = session.execute(
+                update(TranscodeJob)
+                .where(
+                    TranscodeJob.episode_id == row[0],
+                    TranscodeJob.rendition == row[1],
+                    TranscodeJob.state == "queued",
+                )
+                .values(state="running", attempts=TranscodeJob.attempts + 1)
+            )
+            session.commit()
+            # another worker may have taken it between the two statements
+            if claimed.rowcount:
+                return tuple(row)
+
+
+def finish(
+    engine: Engine,
+    episode_id: int,
+    rendition: str,
+    source_mtime_ns: int,
+    error: str | None = None,
+) -> None:
+    # unless the file changed meanwhile and the job was queued again
+    with Session(engine) as session:
+        session.execute(
+            update(TranscodeJob)
+            .where(
+                TranscodeJob.episode_id == episode_id,
+                TranscodeJob.rendition == rendition,
+                TranscodeJob.source_mtime_ns == source_mtime_ns,
+                TranscodeJob.state == "running",
+            )
+            .values(state="failed" if error else "done", error=error)
+        )
+        session.commit()
+
+
+def requeue_running(engine: Engine) -> None:
+    """jobs a stopped process was running start over"""
+    with Session(engine) as session:
+        session.execute(
+            update(TranscodeJob)
+            .where(TranscodeJob.state == "running")
+            .values(state="queued")
+        )
+        session.commit()
+
+
+def retry_failed(engine: Engine) -> None:
+    with Session(engine) as session:
+        session.execute(
+            update(TranscodeJob)
+            .where(TranscodeJob.state == "failed")
+            .values(state="queued", error=None)
+        )
+        session.commit()
+
+
+class TranscodeQueue:
+    def __init__(
+        self,
+        engine: Engine,
+        root: Path,
+        movies_path: Path,
+        ffmpeg: str = "ffmpeg",
+        workers: int = 1,
+        threads: int = 2,
+        niceness: int = 10,
+        poll_interval: float = 5.0,
+        busy: Callable[[], bool] | None = None,
+    ) -> None:
+        self.engine = engine
+        self.root = root
+        self.movies_path = movies_path
+        self.ffmpeg = ffmpeg
+        self.workers = workers
+        self.threads = threads
+        self.niceness = niceness
+        self.poll_interval = poll_interval
+        self.busy = busy
+        self.running = 0
+
+    def path(self, episode_id: int, rendition: str, source_mtime_ns: int) -> Path:
+        return self.root / str(episode_id) / f"{rendition}-{source_mtime_ns}.mp4"
+
+    def ready(self, jobs: list[TranscodeJob], source_mtime_ns: int) -> dict[str, int]:
+        """finished renditions of this version of the file, name -> bits/s"""
+        return {
+            job.rendition: job.bitrate
+            for job in jobs
+            if job.state == "done"
+            and job.source_mtime_ns == source_mtime_ns
+            and self.path(job.episode_id, job.rendition, source_mtime_ns).is_file()
+        }
+
+    def missing(
+        self, jobs: list[TranscodeJob], source_mtime_ns: int, source_bitrate: int | None
+    ) -> list[Rendition]:
+        """rungs with no job for this version of the file"""
+        if self.workers <= 0:
+            return []
+        queued = {job.rendition for job in jobs if job.source_mtime_ns == source_mtime_ns}
+        return [rung for rung in ladder_for(source_bitrate) if rung.name not in queued]
+
+    async def run(self, until_idle: bool = False) -> None:
+        """work through the queue, forever or until it is empty"""
+        if self.workers <= 0:
+            return
+        await anyio.to_thread.run_sync(requeue_running, self.engine)
+        async with anyio.create_task_group() as group:
+            for _ in range(self.workers):
+                group.start_soon(self._work, until_idle)
+
+    async def _work(self, until_idle: bool) -> None:
+        while True:
+            if self.busy is not None and self.busy():
+                await anyio.sleep(self.poll_interval)
+                continue
+            job = await anyio.to_thread.run_sync(claim, self.engine)
+            if job is None:
+                if until_idle:
+                    return
+                await anyio.sleep(self.poll_interval)
+                continue
+            self.running += 1
+            try:
+                await self.transcode(*job)
+            finally:
+                self.running -= 1
+
+    async def transcode(
+        self, episode_id: int, rendition: str, source_mtime_ns: int, name: str
+    ) -> None:
+        source = self.movies_path / f"{name}.mp4"
+        target = self.path(episode_id, rendition, source_mtime_ns)
+        error = None
+        try:
+            if source.stat().st_mtime_ns != source_mtime_ns:
+                raise RuntimeError("the file changed after the job was queued")
+            await self.encode(source, target, RENDITIONS[rendition])
+            # earlier versions of this rung are unreachable now
+            for old in target.parent.glob(f"{rendition}-*.mp4"):
+                if old != target:
+                    old.unlink(missing_ok=True)
+        except Exception as exception:
+            logger.exception("transcoding episode %s to %s failed", episode_id, rendition)
+            error = str(exception) or type(exception).__name__
+        await anyio.to_thread.run_sync(
+            finish, self.engine, episode_id, rendition, source_mtime_ns, error
+        )
+
+    async def encode(self, source: Path, target: Path, rendition: Rendition) -> None:
+        # written next to the target and renamed, a half-written file is never served
+        target.parent.mkdir(parents=True, exist_ok=True)
+        scratch = target.with_name(f".{target.name}")
+        command = ffmpeg_command(self.ffmpeg, source, scratch, rendition, self.threads)
+        if self.niceness:
+            # below the server in the CPU queue
+            command = ["nice", "-n", str(self.niceness), *command]
+        try:
+            # cancelling it (on shutdown) kills ffmpeg
+            await anyio.run_process(command)
+        except BaseException as error:
+            scratch.unlink(missing_ok=True)
+            if isinstance(error, subprocess.CalledProcessError):
+                message = error.stderr.decode(errors="replace").strip()
+                raise RuntimeError(message or f"ffmpeg exited {error.returncode}") from error
+            raise
+        scratch.replace(target)
+
+
+if __name__ == "__main__":
+    from app.config import get_app_settings
+    from app.database import create_db_and_tables, engine
+    from app.models import MediaProbe
+
+    settings = get_app_settings()
+    create_db_and_tables()
+    # the server leaves failed jobs alone until the file changes, this retries them
+    retry_failed(engine)
+    queue = TranscodeQueue(
+        engine,
+        settings.renditions_path,
+        settings.movies_path,
+        ffmpeg=settings.ffmpeg_path,
+        workers=settings.transcode_workers or 1,
+        threads=settings.transcode_threads,
+        niceness=settings.transcode_niceness,
+    )
+    with Session(engine) as session:
+        episodes = session.exec(
+            select(Episode.id, Episode.name, MediaProbe.bitrate).outerjoin(
+                MediaProbe, MediaProbe.episode_id == Episode.id
+            )
+        ).all()
+        jobs = session.exec(select(TranscodeJob)).all()
+
+    for episode_id, name, bitrate in episodes:
+        source = settings.movies_path / f"{name}.mp4"
+        if not source.is_file():
+            continue
+        mtime_ns = source.stat().st_mtime_ns
+        own = [job for job in jobs if job.episode_id == episode_id]
+        rungs = queue.missing(own, mtime_ns, bitrate)
+        if rungs:
+            enqueue(engine, episode_id, mtime_ns, rungs)
+            print(f"{name}: queued {', '.join(rung.name for rung in rungs)}")
+
+    anyio.run(queue.run, True)
+    with Session(engine) as session:
+        failed = session.exec(select(TranscodeJob).where(TranscodeJob.state == "failed")).all()
+    for job in failed:
+        print(f"episode {job.episode_id} {job.rendition} failed: {job.error}")
+    sys.exit(1 if failed else 0)
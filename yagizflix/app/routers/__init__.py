@@ -1,4 +1,5 @@
+from .api import router as api_router
 from .player import router as player_router
 from .titles import router as titles_router
 
-__all__ = ["player_router", "titles_router"]
+__all__ = ["api_router", "player_router", "titles_router"]
@@ -0,0 +1,99 @@
+from typing import Annotated
+
+from fastapi import Query
+from fastapi.routing import APIRouter
+from sqlmodel import select
+
+from app.database import ReadSession
+from app.models import Episode, Tag, Title, TitleTagsLink
+from app.pagination import keyset_page, parse_fields
+
+router = APIRouter()
+
+TITLE_FIELDS = ("id", "name", "watch_later", "release_date")
+TAG_FIELDS = ("id", "name", "description")
+EPISODE_FIELDS = (
+    "id",
+    "title_id",
+    "name",
+    "season",
+    "episode_number",
+    "completed",
+    "left_at",
+)
+
+Limit = Annotated[int, Query(ge=1, le=200)]
+
+
+@router.get("/titles", name="api_titles")
+def list_titles(
+    session: ReadSession,
+    tag: Annotated[int | None, Query()] = None,
+    watch_later: Annotated[bool | None, Query()] = None,
+    fields: Annotated[str | None, Query()] = None,
+    after: Annotated[str | None, Query()] = None,
+    limit: Limit = 50,
+):
+    # (name, id) is covered by ix_title_name_id, and within a tag by
+    # ix_titletagslink_tag_id_title_name through the link's copy of the name
+    query = select(Title)
+    order = (Title.name, Title.id)
+    if tag is not None:
+        query = query.join(TitleTagsLink, TitleTagsLink.title_id == Title.id).where(
+            TitleTagsLink.tag_id == tag
+        )
+        order = (TitleTagsLink.title_name, TitleTagsLink.title_id)
+    if watch_later is not None:
+        query = query.where(Title.watch_later == watch_later)
+
+    return keyset_page(
+        session,
+        query,
+        order=order,
+        columns={field: getattr(Title, field) for field in TITLE_FIELDS},
+        fields=parse_fields(fields, TITLE_FIELDS),
+        after=after,
+        limit=limit,
+    )
+
+
+@router.get("/tags", name="api_tags")
+def list_tags(
+    session: ReadSession,
+    fields: Annotated[str | None, Query()] = None,
+    after: Annotated[str | None, Query()] = None,
+    limit: Limit = 50,
+):
+    return keyset_page(
+        session,
+        select(Tag),
+        order=(Tag.name, Tag.id),
+        columns={field: getattr(Tag, field) for field in TAG_FIELDS},
+        fields=parse_fields(fields, TAG_FIELDS),
+        after=after,
+        limit=limit,
+    )
+
+
+@router.get("/episodes", name="api_episodes")
+def list_episodes(
+    session: ReadSession,
+    title_id: Annotated[int | None, Query()] = None,
+    fields: Annotated[str | None, Query()] = None,
+    after: Annotated[str | None, Query()] = None,
+    limit: Limit = 50,
+):
+    # within a title this walks ix_episode_title_season_episode
+    query = select(Episode)
+    if title_id is not None:
+        query = query.where(Episode.title_id == title_id)
+
+    return keyset_page(
+        session,
+        query,
+        order=(Episode.title_id, Episode.season, Episode.episode_number, Episode.id),
+        columns={field: getattr(Episode, field) for field in EPISODE_FIELDS},
+        fields=parse_fields(fields, EPISODE_FIELDS),
+        after=after,
+        limit=limit,
+    )
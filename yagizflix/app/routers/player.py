@@ -1,56 +1,360 @@
+import os
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Annotated
+
+import anyio
 from fastapi.routing import APIRouter
-from fastapi.responses import StreamingResponse
 from fastapi.requests import Request
-from fastapi import Query
-from typing import Annotated
+from fastapi import HTTPException, Query
 from app.config import get_app_settings
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
-from app.database import Session
-from sqlmodel import select
-from app.models import Episode
+from app.rendering import templates
+from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse, Response
+from app.database import ReadSession, engine, progress_buffer
+from sqlmodel import Field, SQLModel, select
+from app.models import Artwork, Episode, TranscodeJob
+from app.artwork import (
+    KINDS,
+    SPRITE_COLUMNS,
+    SPRITE_ROWS,
+    ArtworkGenerator,
+    digest_path,
+    sprite_interval,
+)
+from app.block_cache import BlockCache
+from app.navigation import episode_orders
+from app.packaging import CONTENT_TYPES, PLAYLIST_NAME, Packager
+from app.probe import ensure_probe
+from app.renditions import SOURCE, TranscodeQueue, choose, client_bandwidth, enqueue
+from app.streaming import StreamScheduler, VideoFileResponse, align_chunk_size
 
 settings = get_app_settings()
-templates = Jinja2Templates(directory=settings.templates_path / "player")
-movies_path = settings.static_path / "movies"
+movies_path = settings.movies_path
 router = APIRouter()
 
+scheduler = StreamScheduler(
+    max_streams=settings.max_concurrent_streams,
+    max_queued=settings.stream_queue_size,
+    queue_timeout=settings.stream_queue_timeout,
+    retry_after=settings.stream_retry_after,
+    bandwidth=settings.stream_bandwidth,
+    stream_bandwidth=settings.stream_max_bandwidth,
+)
+block_cache = BlockCache(
+    settings.block_cache_size,
+    block_size=align_chunk_size(settings.stream_chunk_size),
+    head_size=settings.block_cache_head_size,
+    use_mmap=settings.block_cache_mmap,
+)
+packager = Packager(
+    settings.hls_path,
+    segment_duration=settings.hls_segment_duration,
+    ffmpeg=settings.ffmpeg_path,
+)
+
+artwork = ArtworkGenerator(
+    engine,
+    settings.artwork_path,
+    ffmpeg=settings.ffmpeg_path,
+    workers=settings.artwork_workers,
+    retry_after=settings.artwork_retry_after,
+)
+
+transcoder = TranscodeQueue(
+    engine,
+    settings.renditions_path,
+    movies_path,
+    ffmpeg=settings.ffmpeg_path,
+    workers=settings.transcode_workers,
+    threads=settings.transcode_threads,
+    niceness=settings.transcode_niceness,
+    poll_interval=settings.transcode_poll_interval,
+    busy=lambda: 0 < settings.transcode_pause_streams <= scheduler.active,
+)
+
+# lets Chromium send its bandwidth estimate along with the next requests
+CLIENT_HINTS = "Downlink, Save-Data"
+
+
+def transcode_jobs(session: ReadSession, episode_id: int) -> list[TranscodeJob]:
+    return session.exec(
+        select(TranscodeJob).where(TranscodeJob.episode_id == episode_id)
+    ).all()
+
+
+def queue_renditions(
+    jobs: list[TranscodeJob], episode_id: int, file_path: Path, source_bitrate: int | None
+) -> None:
+    """queue the rungs this version of the file has no job for, once per version"""
+    mtime_ns = file_path.stat().st_mtime_ns
+    missing = transcoder.missing(jobs, mtime_ns, source_bitrate)
+    if missing:
+        enqueue(engine, episode_id, mtime_ns, missing)
+
+
+def pick_rendition(
+    request: Request,
+    jobs: list[TranscodeJob],
+    episode_id: int,
+    file_path: Path,
+    source_bitrate: int | None,
+    rendition: str | None,
+    bandwidth: int | None,
+) -> tuple[str, Path, int | None]:
+    """the rendition to play, its file and bits/s, out of the finished `jobs`"""
+    mtime_ns = file_path.stat().st_mtime_ns
+    # an unprobed original counts as too big for any measured bandwidth
+    options = {SOURCE: source_bitrate or sys.maxsize, **transcoder.ready(jobs, mtime_ns)}
+    name = choose(options, rendition, client_bandwidth(request.headers, bandwidth))
+    if name == SOURCE:
+        return name, file_path, source_bitrate
+    return name, transcoder.path(episode_id, name, mtime_ns), options[name]
+
+
+@dataclass(frozen=True)
+class StreamSource:
+    episode_id: int
+    rendition: str
+    path: Path
+    stat_result: os.stat_result
+    headers: dict[str, str]
+
 
 @router.get("/stream", name="stream")
-def stream_video(
+async def stream_video(
     request: Request,
-    session: Session,
+    session: ReadSession,
     q: Annotated[str, Query()] = "1",
+    rendition: Annotated[str | None, Query()] = None,
+    bandwidth: Annotated[int | None, Query(ge=0)] = None,
 ):
+    # the lookups block, waiting for a slot must not
+    source = await anyio.to_thread.run_sync(
+        stream_source, request, session, q, rendition, bandwidth
+    )
+    ticket = await scheduler.admit()
+    request.state.metrics_episode = source.episode_id
+
+    # answers Range/If-Range itself: 206 + Content-Range for single ranges,
+    # multipart/byteranges for multiple, ETag and Accept-Ranges on every
+    # response, so seeking only fetches the bytes that are played
+    return VideoFileResponse(
+        source.path,
+        media_type="video/mp4",
+        headers=source.headers,
+        stat_result=source.stat_result,
+        chunk_size=settings.stream_chunk_size,
+        ticket=ticket,
+        cache=block_cache if settings.block_cache_size else None,
+        cache_key=(source.episode_id, source.rendition, source.stat_result.st_mtime_ns),
+    )
+
+
+def stream_source(
+    request: Request,
+    session: ReadSession,
+    q: str,
+    rendition: str | None,
+    bandwidth: int | None,
+) -> StreamSource:
     query = select(Episode).where(Episode.id == q)
     result = session.exec(query)
     episode = result.one()
     file_path = movies_path / f"{episode.name}.mp4"
-    assert file_path.exists(), f"File {file_path} does not exist"
+    if not file_path.is_file():
+        raise HTTPException(status_code=404, detail="Video file not found")
+
+    # the player names the rendition, so every range of one playback comes
+    # from the same file; other clients get one picked from their hints. Only
+    # the player page queues renditions, ranges never write
+    source_bitrate = episode.probe.bitrate if episode.probe else None
+    name, file_path, _ = pick_rendition(
+        request,
+        transcode_jobs(session, episode.id),
+        episode.id,
+        file_path,
+        source_bitrate,
+        rendition,
+        bandwidth,
+    )
+    headers = {"X-Rendition": name}
+    if rendition is None:
+        headers["Vary"] = CLIENT_HINTS
+    if episode.probe is not None and episode.probe.duration:
+        headers["X-Content-Duration"] = f"{episode.probe.duration:.3f}"
+    return StreamSource(episode.id, name, file_path, file_path.stat(), headers)
 
-    def iterfile(file_name: str):
-        with open(file_path, mode="rb") as file_like:
-            yield from file_like
 
-    return StreamingResponse(iterfile(q), media_type="video/mp4")
+@router.get("/hls/{episode_id}/index.m3u8", name="hls_playlist")
+def hls_playlist(request: Request, session: ReadSession, episode_id: int):
+    query = select(Episode).where(Episode.id == episode_id)
+    result = session.exec(query)
+    episode = result.one()
+    file_path = movies_path / f"{episode.name}.mp4"
+    if not file_path.is_file():
+        raise HTTPException(status_code=404, detail="Video file not found")
+
+    version = packager.packaged_version(episode_id, file_path)
+    if version is None:
+        # packaging runs on the event loop
+        anyio.from_thread.run_sync(packager.schedule, episode_id, file_path)
+        raise HTTPException(
+            status_code=503,
+            detail="Episode is being packaged",
+            headers={"Retry-After": str(settings.hls_segment_duration)},
+        )
+
+    # the entry point is the only mutable URL, it points at the current version
+    url = request.url_for(
+        "hls_file", episode_id=episode_id, version=version, file_name=PLAYLIST_NAME
+    )
+    return RedirectResponse(url, status_code=307, headers={"Cache-Control": "no-cache"})
+
+
+@router.get("/hls/{episode_id}/{version}/{file_name}", name="hls_file")
+async def hls_file(episode_id: int, version: str, file_name: str):
+    file_path = packager.version_path(episode_id, version) / file_name
+    media_type = CONTENT_TYPES.get(file_path.suffix)
+    hidden = version.startswith(".") or file_name.startswith(".")
+    if media_type is None or hidden or not file_path.is_file():
+        raise HTTPException(status_code=404, detail="Segment not found")
+
+    return FileResponse(
+        file_path,
+        media_type=media_type,
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
+
+
+@router.get("/artwork/{episode_id}/{kind}", name="artwork")
+def episode_artwork(
+    request: Request, session: ReadSession, episode_id: int, kind: str
+):
+    episode = session.get(Episode, episode_id)
+    if episode is None or kind not in KINDS:
+        raise HTTPException(status_code=404, detail="Artwork not found")
+    file_path = movies_path / f"{episode.name}.mp4"
+    if not file_path.is_file():
+        raise HTTPException(status_code=404, detail="Video file not found")
+
+    stored = session.get(Artwork, (episode_id, kind))
+    duration = episode.probe.duration if episode.probe else None
+    if current_artwork(episode_id, kind, file_path, stored, duration) is None:
+        # the placeholder stands in until it is rendered, revalidated every time
+        return FileResponse(
+            settings.static_path / "img" / "poster.svg",
+            media_type="image/svg+xml",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    # served here rather than redirected to the digest URL, a poster costs one
+    # request and revalidates against the digest of the current image
+    return image_response(request, stored.digest, "no-cache")
+
+
+@router.get("/artwork/{digest}.jpg", name="artwork_image")
+async def artwork_image(request: Request, digest: str):
+    if len(digest) != 64 or not digest.isalnum():
+        raise HTTPException(status_code=404, detail="Artwork not found")
+    return image_response(request, digest, "public, max-age=31536000, immutable")
+
+
+def current_artwork(
+    episode_id: int,
+    kind: str,
+    file_path: Path,
+    stored: Artwork | None,
+    duration: float | None,
+) -> Path | None:
+    """
+    the image made from this version of the file, scheduling it when there is
+    none; called from the threadpool, rendering is started on the event loop
+    """
+    image = artwork.current(stored, file_path)
+    if image is None:
+        anyio.from_thread.run_sync(artwork.schedule, episode_id, kind, file_path, duration)
+    return image
+
+
+def image_response(request: Request, digest: str, cache_control: str) -> Response:
+    file_path = digest_path(settings.artwork_path, digest)
+    if not file_path.is_file():
+        raise HTTPException(status_code=404, detail="Artwork not found")
+    # the digest is the content, so it is a strong validator
+    headers = {"ETag": f'"{digest}"', "Cache-Control": cache_control}
+    if f'"{digest}"' in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(file_path, media_type="image/jpeg", headers=headers)
+
+
+class ProgressUpdate(SQLModel):
+    episode_id: int
+    position: int = Field(ge=0)  # seconds into the episode
+    completed: bool = False
+
+
+@router.post("/progress", status_code=204, name="progress")
+def save_progress(progress: ProgressUpdate, session: ReadSession):
+    query = select(Episode.id).where(Episode.id == progress.episode_id)
+    if session.exec(query).first() is None:
+        raise HTTPException(status_code=404, detail="Episode not found")
+
+    # buffered, written in a batch with everyone else's progress
+    progress_buffer.record(progress.episode_id, progress.position, progress.completed)
 
 
 @router.get("/", response_class=HTMLResponse, name="player")
-async def player(
+def player(
     request: Request,
-    session: Session,
+    session: ReadSession,
     q: Annotated[str, Query()] = "1",
+    rendition: Annotated[str | None, Query()] = None,
+    bandwidth: Annotated[int | None, Query(ge=0)] = None,
 ):
     query = select(Episode).where(Episode.id == q)
     result = session.exec(query)
     episode = result.one()
+    title_episodes = episode_orders.get(session, episode.title_id)
+    previous_id, next_id = title_episodes.neighbours(episode.id)
+
+    # probed once per file, the scanner normally got to it already
+    file_path = movies_path / f"{episode.name}.mp4"
+    probe = ensure_probe(engine, episode.id, file_path) if file_path.is_file() else None
+    chosen, bitrate, sprite = None, None, None
+    if probe is not None:
+        jobs = transcode_jobs(session, episode.id)
+        queue_renditions(jobs, episode.id, file_path, probe.bitrate)
+        chosen, _, bitrate = pick_rendition(
+            request, jobs, episode.id, file_path, probe.bitrate, rendition, bandwidth
+        )
+        # thumbnails over the seek bar, once the sheet is rendered
+        stored = session.get(Artwork, (episode.id, "sprite"))
+        if probe.duration and current_artwork(
+            episode.id, "sprite", file_path, stored, probe.duration
+        ):
+            sprite = {
+                "url": request.url_for("artwork_image", digest=stored.digest),
+                "interval": sprite_interval(probe.duration),
+                "columns": SPRITE_COLUMNS,
+                "rows": SPRITE_ROWS,
+            }
 
-    return templates.TemplateResponse(
-        "player.html",
+    response = templates.TemplateResponse(
+        "player/player.html",
         {
             "request": request,
             "video_file": q,
-            "next": episode.next.id if episode.next else None,
-            "previous": episode.previous.id if episode.previous else None,
+            "episode_id": episode.id,
+            "left_at": progress_buffer.pending_position(episode.id) or episode.left_at,
+            "duration": probe.duration if probe else None,
+            "rendition": chosen,
+            "bitrate": bitrate,
+            "sprite": sprite,
+            "next": next_id,
+            "previous": previous_id,
         },
     )
+    response.headers["Accept-CH"] = CLIENT_HINTS
+    response.headers["Vary"] = CLIENT_HINTS
+    return response
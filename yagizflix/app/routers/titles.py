@@ -1,16 +1,19 @@
+import anyio
 from fastapi.routing import APIRouter
 from fastapi.responses import HTMLResponse
 from fastapi.requests import Request
-from fastapi import Query
-from sqlmodel import select
+from fastapi import HTTPException, Query
+from sqlalchemy import exists
+from sqlmodel import Session, select
 from typing import Annotated
-from app.database import Session
-from app.models import Title
-from fastapi.templating import Jinja2Templates
-from app.config import get_app_settings
-
-settings = get_app_settings()
-templates = Jinja2Templates(directory=settings.templates_path / "titles")
+from app.database import ReadSession, read_engine
+from app.models import Tag, Title, TitleTagsLink
+from app.rendering import templates
+from app.navigation import episode_orders
+from app.page_cache import page_cache
+from app.routers.player import episode_artwork
+from app.search import search_titles
+from app.suggest import suggest_index
 
 router = APIRouter()
 
@@ -18,34 +21,95 @@ router = APIRouter()
 
 
 @router.get("/titles", response_class=HTMLResponse, name="titles")
-async def list_titles(request: Request, session: Session):
-    query = select(Title)
-    result = session.exec(query)
-    titles = result.all()
+def list_titles(request: Request, session: ReadSession):
+    return page_cache.respond(request, lambda: render_titles(request, session))
 
-    from collections import defaultdict
 
-    titles_by_tag = defaultdict(list)
-    for title in titles:
-        for tag in title.tags:
-            titles_by_tag[tag.name].append(title)
+def render_titles(request: Request, session: Session):
+    # only the tags, each row pages its titles in from /api/titles as it scrolls
+    # into view, so the page stays the same size however big the catalogue is
+    query = (
+        select(Tag.id, Tag.name)
+        .where(exists().where(TitleTagsLink.tag_id == Tag.id))
+        .order_by(Tag.name, Tag.id)
+    )
+    tags = session.exec(query).all()
 
     return templates.TemplateResponse(
-        "titles.html", {"request": request, "titles_by_tag": titles_by_tag}
+        "titles/titles.html", {"request": request, "tags": tags}
     )
 
 
 @router.get("/titles/{title_id}", name="title_detail", response_class=HTMLResponse)
-async def get_title(request: Request, title_id: int, session: Session):
+def get_title(request: Request, title_id: int, session: ReadSession):
+    return page_cache.respond(
+        request, lambda: render_title(request, title_id, session)
+    )
+
+
+def render_title(request: Request, title_id: int, session: Session):
     query = select(Title).where(Title.id == title_id)
     result = session.exec(query)
     title = result.one()
 
+    title_episodes = episode_orders.get(session, title.id)
+
     return templates.TemplateResponse(
-        "title_detail.html", {"request": request, "title": title}
+        "titles/title_details.html",
+        {
+            "request": request,
+            "title": title,
+            "seasons": title_episodes.seasons(),
+            "first_episode": next(iter(title_episodes.episodes), None),
+        },
     )
 
 
+@router.get("/titles/{title_id}/poster", name="title_poster")
+def title_poster(request: Request, title_id: int, session: ReadSession):
+    # a title's poster is its first episode's
+    first_episode = next(iter(episode_orders.get(session, title_id).episodes), None)
+    if first_episode is None:
+        raise HTTPException(status_code=404, detail="Title has no episodes")
+    return episode_artwork(request, session, first_episode.id, "poster")
+
+
 @router.get("/movies/search", name="movie_search", response_class=HTMLResponse)
-async def search(request: Request, session: Session, q: Annotated[str, Query()] = ""):
-    raise NotImplementedError("Search is not implemented")
+def search(
+    request: Request,
+    session: ReadSession,
+    q: Annotated[str, Query()] = "",
+    page: Annotated[int, Query(ge=1)] = 1,
+    page_size: Annotated[int, Query(ge=1, le=100)] = 20,
+):
+    # fetch one extra row to know whether there is a next page
+    offset = (page - 1) * page_size
+    titles = search_titles(session, q, limit=page_size + 1, offset=offset)
+
+    return templates.TemplateResponse(
+        "titles/search.html",
+        {
+            "request": request,
+            "q": q,
+            "titles": titles[:page_size],
+            "page": page,
+            "page_size": page_size,
+            "has_next": len(titles) > page_size,
+        },
+    )
+
+
+@router.get("/suggest", name="suggest")
+async def suggest(
+    q: Annotated[str, Query()] = "",
+    k: Annotated[int, Query(ge=1, le=50)] = 10,
+):
+    if suggest_index.stale:
+        with Session(read_engine) as session:
+            await anyio.to_thread.run_sync(suggest_index.load, session)
+
+    # served from memory, keystrokes never reach the database
+    return [
+        {"kind": entry.kind, "id": entry.id, "name": entry.name}
+        for entry in suggest_index.suggest(q, k)
+    ]
@@ -0,0 +1,400 @@
+"""
+Bulk library scanner
+
+Walks a media root, parses title/season/episode out of file names and brings
+the catalogue in line with what is on disk:
+
+- files are stat()ed in parallel and compared with their stored fingerprint
+  (size + mtime), so a rescan only touches what changed
+- titles, episodes, tags and fingerprints are written with executemany in
+  batched transactions instead of one commit per row
+- a file that disappeared while another with the same fingerprint showed up
+  was renamed, its episode (with watch progress, probe and artwork) follows it
+- files that disappeared take their episode, its probe, artwork and
+  transcodes with them, and titles left without episodes go too
+- new and changed files are probed (duration, bitrate, moov position) once
+
+File names look like `some_show_s01e02.mp4` (movies are anything without the
+`sXXeYY` part) and a file inside a top-level folder gets that folder as a tag.
+
+Run `python -m app.scanner [media root]`, it defaults to `movies_path`.
+"""
+
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+from pathlib import Path
+
+from sqlalchemy import Engine, delete, insert, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session
+
+from .models import (
+    Artwork,
+    Episode,
+    MediaFile,
+    MediaProbe,
+    Tag,
+    Title,
+    TitleTagsLink,
+    TranscodeJob,
+)
+from .probe import probe_row, save_probes
+
+EPISODE_PATTERN = re.compile(
+    r"^(?P<title>.*?)[\s._-]*s(?P<season>\d{1,3})[\s._-]*e(?P<episode>\d{1,4})",
+    re.IGNORECASE,
+)
+SUFFIX = ".mp4"
+
+
+@dataclass(frozen=True)
+class ParsedFile:
+    path: str
+    size: int
+    mtime_ns: int
+    title: str
+    season: int
+    episode_number: int
+    tag: str | None
+
+
+@dataclass
+class ScanResult:
+    added: list[str] = field(default_factory=list)
+    updated: list[str] = field(default_factory=list)
+    renamed: list[tuple[str, str]] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    unchanged: int = 0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.updated or self.renamed or self.removed)
+
+
+def title_name(raw: str) -> str:
+    words = re.sub(r"[\s._-]+", " ", raw).strip()
+    return words.title() if words.islower() else words
+
+
+def parse_path(path: str, size: int, mtime_ns: int) -> ParsedFile:
+    """`path` is relative to the media root and has no suffix"""
+    parts = path.split("/")
+    stem = parts[-1]
+    tag = parts[0] if len(parts) > 1 else None
+
+    match = EPISODE_PATTERN.match(stem)
+    if match is None:
+        return ParsedFile(path, size, mtime_ns, title_name(stem), 1, 1, tag)
+
+    # "s01e02.mp4" inside a show folder takes its title from the folder
+    raw_title = match["title"] or (parts[-2] if len(parts) > 1 else stem)
+    return ParsedFile(
+        path,
+        size,
+        mtime_ns,
+        title_name(raw_title),
+        max(1, int(match["season"])),
+        max(1, int(match["episode"])),
+        tag,
+    )
+
+
+def walk(root: Path) -> list[str]:
+    """relative paths of every video under root, without the suffix"""
+    found = []
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(Path(entry.path))
+                elif entry.name.lower().endswith(SUFFIX):
+                    relative = Path(entry.path).relative_to(root).as_posix()
+                    found.append(relative[: -len(SUFFIX)])
+    return found
+
+
+def stat_files(root: Path, paths: list[str], workers: int) -> dict[str, os.stat_result]:
+    """stat in parallel, on network storage every stat is a round trip"""
+
+    def stat(path: str) -> os.stat_result | None:
+        try:
+            return os.stat(root / f"{path}{SUFFIX}")
+        except FileNotFoundError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(stat, paths, chunksize=256)
+        return {path: st for path, st in zip(paths, results) if st is not None}
+
+
+def batched(items: list, size: int):
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class LibraryScanner:
+    def __init__(
+        self, engine: Engine, root: Path, batch_size: int = 5000, workers: int = 32
+    ) -> None:
+        self.engine = engine
+        self.root = root
+        self.batch_size = batch_size
+        self.workers = workers
+
+    def scan(self) -> ScanResult:
+        """full walk of the media root"""
+        return self.sync(walk(self.root), complete=True)
+
+    def sync(
+        self, paths: list[str], complete: bool = False, trees: list[str] = ()
+    ) -> ScanResult:
+        """
+        bring the given relative paths (without suffix) up to date; paths that
+        no longer exist are removed. `trees` are relative directories that were
+        added, moved or deleted as a whole, everything on disk or known under
+        them is synced too. With `complete` every known file missing from
+        `paths` is removed as well.
+        """
+        result = ScanResult()
+        paths = list(paths)
+        for tree in trees:
+            if (self.root / tree).is_dir():
+                paths += [f"{tree}/{path}" for path in walk(self.root / tree)]
+        stats = stat_files(self.root, paths, self.workers)
+
+        with Session(self.engine) as session:
+            known = {
+                row.path: row
+                for row in session.execute(
+                    select(MediaFile.path, MediaFile.size, MediaFile.mtime_ns)
+                )
+            }
+
+        changed = []
+        for path, st in stats.items():
+            fingerprint = known.get(path)
+            if fingerprint is None:
+                result.added.append(path)
+            elif (fingerprint.size, fingerprint.mtime_ns) != (st.st_size, st.st_mtime_ns):
+                result.updated.append(path)
+            else:
+                result.unchanged += 1
+                continue
+            changed.append(parse_path(path, st.st_size, st.st_mtime_ns))
+
+        missing = known.keys() - stats.keys()
+        if not complete:
+            prefixes = tuple(f"{tree}/" for tree in trees)
+            requested = set(paths)
+            missing = {
+                path for path in missing if path in requested or path.startswith(prefixes)
+            }
+
+        vanished = {(known[path].size, known[path].mtime_ns): path for path in missing}
+        for path in list(result.added):
+            old_path = vanished.pop((stats[path].st_size, stats[path].st_mtime_ns), None)
+            if old_path is not None:
+                result.added.remove(path)
+                result.renamed.append((old_path, path))
+                missing.discard(old_path)
+        result.removed = sorted(missing)
+
+        for batch in batched(result.renamed, self.batch_size):
+            self._rename(batch)
+        for batch in batched(changed, self.batch_size):
+            self._upsert(batch)
+            self._probe(batch)
+        for batch in batched(result.removed, self.batch_size):
+            self._remove(batch)
+        return result
+
+    def _upsert(self, files: list[ParsedFile]) -> None:
+        with Session(self.engine) as session:
+            title_ids = self._ensure_names(session, Title, {f.title for f in files})
+            tag_ids = self._ensure_names(
+                session, Tag, {f.tag for f in files if f.tag is not None}
+            )
+
+            episode_ids = dict(
+                session.execute(
+                    select(Episode.name, Episode.id).where(
+                        Episode.name.in_([f.path for f in files])
+                    )
+                ).all()
+            )
+            rows = [
+                {
+                    "title_id": title_ids[f.title],
+                    "name": f.path,
+                    "season": f.season,
+                    "episode_number": f.episode_number,
+                }
+                for f in files
+            ]
+            new_rows = [row for row in rows if row["name"] not in episode_ids]
+            if new_rows:
+                session.execute(insert(Episode), new_rows)
+            existing_rows = [
+                {**row, "id": episode_ids[row["name"]]}
+                for row in rows
+                if row["name"] in episode_ids
+            ]
+            if existing_rows:
+                session.execute(update(Episode), existing_rows)
+            episode_ids = dict(
+                session.execute(
+                    select(Episode.name, Episode.id).where(
+                        Episode.name.in_([f.path for f in files])
+                    )
+                ).all()
+            )
+
+            links = {
+                (title_ids[f.title], tag_ids[f.tag]) for f in files if f.tag is not None
+            }
+            if links:
+                session.execute(
+                    sqlite_insert(TitleTagsLink).on_conflict_do_nothing(),
+                    [{"title_id": title, "tag_id": tag} for title, tag in links],
+                )
+
+            fingerprint = sqlite_insert(MediaFile)
+            session.execute(
+                fingerprint.on_conflict_do_update(
+                    index_elements=[MediaFile.path],
+                    set_={
+                        "size": fingerprint.excluded.size,
+                        "mtime_ns": fingerprint.excluded.mtime_ns,
+                        "episode_id": fingerprint.excluded.episode_id,
+                    },
+                ),
+                [
+                    {
+                        "path": f.path,
+                        "size": f.size,
+                        "mtime_ns": f.mtime_ns,
+                        "episode_id": episode_ids[f.path],
+                    }
+                    for f in files
+                ],
+            )
+            session.commit()
+
+    def _probe(self, files: list[ParsedFile]) -> None:
+        with Session(self.engine) as session:
+            episode_ids = dict(
+                session.execute(
+                    select(MediaFile.path, MediaFile.episode_id).where(
+                        MediaFile.path.in_([f.path for f in files])
+                    )
+                ).all()
+            )
+
+            def probe(file: ParsedFile) -> dict | None:
+                try:
+                    return probe_row(episode_ids.get(file.path), self.file(file.path))
+                except OSError:
+                    return None
+
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                rows = [row for row in pool.map(probe, files) if row is not None]
+            if rows:
+                save_probes(session, rows)
+                session.commit()
+
+    def _rename(self, renames: list[tuple[str, str]]) -> None:
+        # the upsert that follows fixes title/season and the fingerprint. The
+        # content is unchanged, so the probe moves to the new path and artwork,
+        # keyed by episode, stays valid
+        with Session(self.engine) as session:
+            session.execute(
+                delete(MediaFile).where(MediaFile.path.in_([old for old, _ in renames]))
+            )
+            session.execute(
+                delete(MediaProbe).where(
+                    MediaProbe.path.in_([str(self.file(new)) for _, new in renames])
+                )
+            )
+            for old, new in renames:
+                session.execute(
+                    update(Episode).where(Episode.name == old).values(name=new)
+                )
+                session.execute(
+                    update(MediaProbe)
+                    .where(MediaProbe.path == str(self.file(old)))
+                    .values(path=str(self.file(new)))
+                )
+            session.commit()
+
+    def _remove(self, paths: list[str]) -> None:
+        with Session(self.engine) as session:
+            episodes = session.execute(
+                select(Episode.id, Episode.title_id).where(Episode.name.in_(paths))
+            ).all()
+            episode_ids = [episode.id for episode in episodes]
+            session.execute(delete(MediaFile).where(MediaFile.path.in_(paths)))
+            session.execute(
+                delete(MediaProbe).where(
+                    MediaProbe.path.in_([str(self.file(path)) for path in paths])
+                )
+            )
+            # rows left behind would attach to whatever reuses the episode id
+            for model in (MediaProbe, Artwork, TranscodeJob):
+                session.execute(delete(model).where(model.episode_id.in_(episode_ids)))
+            session.execute(delete(Episode).where(Episode.id.in_(episode_ids)))
+
+            # the search index follows through its triggers, the watcher reloads
+            # the suggestions after a change
+            emptied = select(Title.id).where(
+                Title.id.in_({episode.title_id for episode in episodes}),
+                ~select(Episode.id).where(Episode.title_id == Title.id).exists(),
+            )
+            title_ids = session.execute(emptied).scalars().all()
+            if title_ids:
+                session.execute(
+                    delete(TitleTagsLink).where(TitleTagsLink.title_id.in_(title_ids))
+                )
+                session.execute(delete(Title).where(Title.id.in_(title_ids)))
+            session.commit()
+
+    def file(self, path: str) -> Path:
+        return self.root / f"{path}{SUFFIX}"
+
+    @staticmethod
+    def _ensure_names(session: Session, model, names: set[str]) -> dict[str, int]:
+        """ids of the rows with these names, inserting the missing ones in one go"""
+        if not names:
+            return {}
+        query = select(model.name, model.id).where(model.name.in_(names))
+        ids = dict(session.execute(query).all())
+        missing = names - ids.keys()
+        if missing:
+            session.execute(insert(model), [{"name": name} for name in missing])
+            ids = dict(session.execute(query).all())
+        return ids
+
+
+if __name__ == "__main__":
+    from app.config import get_app_settings
+    from app.database import create_db_and_tables, engine
+
+    root = Path(sys.argv[1]) if len(sys.argv) > 1 else get_app_settings().movies_path
+    create_db_and_tables()
+
+    started = time.perf_counter()
+    result = LibraryScanner(engine, root).scan()
+    print(
+        f"scanned {root} in {time.perf_counter() - started:.2f}s: "
+        f"{len(result.added)} added, {len(result.updated)} updated, "
+        f"{len(result.renamed)} renamed, {len(result.removed)} removed, "
+        f"{result.unchanged} unchanged"
+    )
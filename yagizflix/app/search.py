@@ -0,0 +1,135 @@
+"""
+Full-text search over titles
+
+An SQLite FTS5 table holds one row per title (rowid = title.id) with the title
+name, its tag names and its tag descriptions. Triggers on title, tag and
+titletagslink keep it in sync, so nothing in the app has to remember to
+reindex. Results are ranked with bm25, matches on the name weigh the most.
+
+Every query term is matched as a prefix, which is what type-ahead needs.
+"""
+
+import re
+
+from sqlalchemy import Engine, text
+from sqlmodel import Session, select
+
+from .models import Title
+
+# bm25 column weights: name, tags, tag descriptions
+WEIGHTS = (10.0, 5.0, 1.0)
+
+CREATE_TABLE = """
+CREATE VIRTUAL TABLE title_search USING fts5(
+    name, tags, tag_descriptions,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+"""
+
+
+def _reindex(title_ids: str) -> str:
+    """statements replacing the rows of the titles selected by `title_ids`"""
+    return f"""
+    DELETE FROM title_search WHERE rowid IN ({title_ids});
+    INSERT INTO title_search (rowid, name, tags, tag_descriptions)
+    SELECT
+        title.id,
+        title.name,
+        coalesce(group_concat(tag.name, ' '), ''),
+        coalesce(group_concat(tag.description, ' '), '')
+    FROM title
+    LEFT JOIN titletagslink ON titletagslink.title_id = title.id
+    LEFT JOIN tag ON tag.id = titletagslink.tag_id
+    WHERE title.id IN ({title_ids})
+    GROUP BY title.id;
+    """
+
+
+TRIGGERS = {
+    "title_search_title_insert": (
+        "AFTER INSERT ON title",
+        _reindex("NEW.id"),
+    ),
+    "title_search_title_update": (
+        "AFTER UPDATE OF name ON title",
+        _reindex("NEW.id"),
+    ),
+    "title_search_title_delete": (
+        "AFTER DELETE ON title",
+        "DELETE FROM title_search WHERE rowid = OLD.id;",
+    ),
+    "title_search_link_insert": (
+        "AFTER INSERT ON titletagslink",
+        _reindex("NEW.title_id"),
+    ),
+    "title_search_link_delete": (
+        "AFTER DELETE ON titletagslink",
+        _reindex("OLD.title_id"),
+    ),
+    "title_search_tag_update": (
+        "AFTER UPDATE OF name, description ON tag",
+        _reindex("SELECT title_id FROM titletagslink WHERE tag_id = NEW.id"),
+    ),
+    "title_search_tag_delete": (
+        "AFTER DELETE ON tag",
+        _reindex("SELECT title_id FROM titletagslink WHERE tag_id = OLD.id"),
+    ),
+}
+
+
+def create_search_index(engine: Engine) -> None:
+    """create the FTS table and its triggers, filling it on first creation"""
+    with engine.begin() as connection:
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'title_search'")
+        ).first()
+        if not exists:
+            connection.exec_driver_sql(CREATE_TABLE)
+            for statement in _reindex("SELECT id FROM title").split(";"):
+                if statement.strip():
+                    connection.exec_driver_sql(statement)
+
+        for name, (event, body) in TRIGGERS.items():
+            connection.exec_driver_sql(
+                f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END"
+            )
+
+
+def match_expression(q: str) -> str | None:
+    """every word of `q` as a quoted prefix term, None if there is nothing to match"""
+    terms = re.findall(r"\w+", q.lower())
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def search_titles(
+    session: Session, q: str, limit: int = 20, offset: int = 0
+) -> list[Title]:
+    expression = match_expression(q)
+    if expression is None:
+        return []
+
+    ranked = session.connection().execute(
+        text(
+            "SELECT rowid FROM title_search WHERE title_search MATCH :expression "
+            "ORDER BY bm25(title_search, :name, :tags, :descriptions) "
+            "LIMIT :limit OFFSET :offset"
+        ),
+        {
+            "expression": expression,
+            "name": WEIGHTS[0],
+            "tags": WEIGHTS[1],
+            "descriptions": WEIGHTS[2],
+            "limit": limit,
+            "offset": offset,
+        },
+    )
+    ids = [row.rowid for row in ranked]
+    if not ids:
+        return []
+
+    titles = session.exec(select(Title).where(Title.id.in_(ids))).all()
+    rank = {title_id: position for position, title_id in enumerate(ids)}
+    return sorted(titles, key=lambda title: rank[title.id])
@@ -0,0 +1,42 @@
+"""
+Multi-worker launcher
+
+`python -m app.serve --workers 4` migrates the database once, then starts
+uvicorn with that many worker processes accepting on one socket. With more
+than one worker it points them at a shared state directory (see app.shared)
+and has the block cache map files, unless SHARED_STATE_PATH or
+BLOCK_CACHE_MMAP are already set. Settings come from the environment, which
+every worker inherits, so each one builds the same AppSettings.
+
+Limits like `max_concurrent_streams` stay per worker.
+"""
+
+import argparse
+import os
+
+import uvicorn
+
+from app.config import get_app_settings
+
+
+def main() -> None:
+    settings = get_app_settings()
+    parser = argparse.ArgumentParser(prog="python -m app.serve")
+    parser.add_argument("--workers", type=int, default=settings.workers)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        os.environ.setdefault("SHARED_STATE_PATH", str(settings.base_path / ".shared"))
+        os.environ.setdefault("BLOCK_CACHE_MMAP", "true")
+
+    # before forking, so the workers don't race each other through migrations
+    from app.database import create_db_and_tables
+
+    create_db_and_tables()
+    uvicorn.run("app.main:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
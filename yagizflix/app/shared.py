@@ -0,0 +1,173 @@
+"""
+State shared between worker processes
+
+With `shared_state_path` set (`python -m app.serve` does that for more than
+one worker) the workers of one deployment coordinate through files there:
+
+- `catalogue.generation`, an 8-byte counter every worker maps into memory.
+  Catalogue writes bump it under an flock and every worker's caches compare
+  against it, so an edit in one worker invalidates pages, episode orderings
+  and suggestions in all of them; reading it is a memory access.
+- `pages/`, a disk tier under the in-memory page cache, a page one worker
+  rendered is served by the others without rendering it again. It holds as
+  many pages as the memory tier, oldest out first, and is emptied whenever
+  the generation is bumped.
+- `leader.lock`, whoever holds the flock is the single writer: it runs the
+  library watcher and the transcoding queue and writes watch progress. The
+  lock goes with the process, if the leader dies another worker takes over on
+  its next attempt.
+- `progress.spool`, followers append their coalesced heartbeats here instead
+  of writing SQLite themselves, the leader drains it into its own batch.
+
+Without `shared_state_path` a process takes an flock on `<database>.lock` and
+refuses to start when it can't, so workers started by plain
+`uvicorn --workers N` fail at startup (which stops uvicorn) instead of each
+running their own watcher, transcoder and progress writer on unshared caches.
+
+Video blocks are not shared here, with several workers the block cache should
+map files (`block_cache_mmap`) so that all of them read the same OS page cache.
+"""
+
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import struct
+from contextlib import contextmanager, suppress
+from pathlib import Path
+
+
+@contextmanager
+def locked(path: Path):
+    with open(path, "a+b") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+class SharedCounter:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with locked(path.with_suffix(".lock")):
+            with open(path, "a+b") as file:
+                if os.fstat(file.fileno()).st_size < 8:
+                    file.truncate(8)
+        with open(path, "r+b") as file:
+            self._map = mmap.mmap(file.fileno(), 8)
+
+    @property
+    def value(self) -> int:
+        return struct.unpack_from("<Q", self._map)[0]
+
+    def bump(self) -> int:
+        with locked(self.path.with_suffix(".lock")):
+            value = self.value + 1
+            struct.pack_into("<Q", self._map, 0, value)
+        return value
+
+
+class LeaderLock:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._file = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._file is not None
+
+    def try_acquire(self) -> bool:
+        if self._file is not None:
+            return True
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        file = open(self.path, "a+b")
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return False
+        self._file = file
+        return True
+
+    def release(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ProgressSpool:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock_path = path.with_suffix(".lock")
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+    def append(self, rows: list[dict]) -> None:
+        lines = "".join(json.dumps(row, separators=(",", ":")) + "\n" for row in rows)
+        with locked(self._lock_path):
+            with open(self.path, "a") as file:
+                file.write(lines)
+
+    def drain(self) -> dict[int, dict]:
+        """the latest spooled row per episode, emptying the spool"""
+        draining = self.path.with_name(f"{self.path.name}.{os.getpid()}")
+        with locked(self._lock_path):
+            try:
+                os.replace(self.path, draining)
+            except FileNotFoundError:
+                return {}
+        rows = {}
+        with open(draining) as file:
+            for line in file:
+                if line.strip():
+                    row = json.loads(line)
+                    rows[row["id"]] = row
+        draining.unlink()
+        return rows
+
+
+class DiskStore:
+    """pickled objects by key, written atomically so readers never see half a file"""
+
+    def __init__(self, path: Path, max_entries: int = 1024) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        path.mkdir(parents=True, exist_ok=True)
+
+    def file(self, key: str) -> Path:
+        return self.path / hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+    def get(self, key: str):
+        try:
+            return pickle.loads(self.file(key).read_bytes())
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def put(self, key: str, value) -> None:
+        path = self.file(key)
+        scratch = path.with_name(f".{path.name}.{os.getpid()}")
+        scratch.write_bytes(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        os.replace(scratch, path)
+        self.prune()
+
+    def entries(self) -> list[os.DirEntry]:
+        # scratch files start with a dot and belong to a writer
+        return [entry for entry in os.scandir(self.path) if not entry.name.startswith(".")]
+
+    def prune(self) -> None:
+        """drop the oldest objects beyond `max_entries`"""
+        entries = self.entries()
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+        for entry in entries[: len(entries) - self.max_entries]:
+            with suppress(FileNotFoundError):
+                os.unlink(entry.path)
+
+    def clear(self) -> None:
+        for entry in self.entries():
+            with suppress(FileNotFoundError):
+                os.unlink(entry.path)
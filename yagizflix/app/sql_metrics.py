@@ -0,0 +1,44 @@
+"""
+SQL statement metrics
+
+Engine hooks counting every statement and its time, in total per engine and
+for the request being handled (the `request_stats` context variable that
+`MetricsMiddleware(count_queries=True)` sets). Kept apart from app.metrics,
+which is shared with home-media-server and has no SQLAlchemy.
+"""
+
+import time
+
+from sqlalchemy import Engine, event
+
+from .metrics import registry, request_stats
+
+queries = registry.counter("db_queries_total", "SQL statements run", ("engine",))
+query_seconds = registry.counter(
+    "db_query_seconds_total", "Time spent in SQL statements", ("engine",)
+)
+
+
+def instrument_engine(engine: Engine, name: str) -> None:
+    """count statements and their time, in total and for the current request"""
+    labels = (name,)
+
+    # a connection runs one statement at a time, so one start time is enough
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, *args):
+        conn.info["metrics_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None:
+            context.connection.info.pop("metrics_started", None)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, *args):
+        elapsed = time.perf_counter() - conn.info.pop("metrics_started")
+        queries.inc(labels)
+        query_seconds.inc(labels, elapsed)
+        stats = request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_seconds += elapsed
@@ -0,0 +1,208 @@
+"""
+Type-ahead suggestions for title and tag names
+
+Keeps every word-start suffix of each normalized name ("ben stiller" and
+"stiller") in one sorted list, so a prefix is a bisect away and suggestions
+never touch the database. The index is loaded once at startup and then kept
+current from ORM flushes: committed Title/Tag inserts, renames and deletes
+are applied in place, episode inserts/deletes adjust title popularity and
+titles added to or removed from a tag adjust the tag's.
+
+Popularity is the number of episodes for a title and of titles for a tag.
+Every match of a prefix is ranked. Up to `CANDIDATES` keys are ranked per
+request, a prefix with more (a letter or two) is ranked once and its top `TOP`
+kept until an entry under it changes, so short prefixes cost a dict lookup.
+"""
+
+import heapq
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from dataclasses import dataclass, field
+
+from sqlalchemy import event, func, inspect
+from sqlmodel import Session, select
+
+from .models import Episode, Tag, Title, TitleTagsLink
+from .page_cache import catalogue_generation
+
+CANDIDATES = 200
+# the most a request asks for, see the /suggest route
+TOP = 50
+
+
+def normalize(name: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", name)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.casefold().split())
+
+
+@dataclass
+class Entry:
+    kind: str
+    id: int
+    name: str
+    popularity: int = 0
+    keys: list[str] = field(default_factory=list)
+
+
+class SuggestIndex:
+    def __init__(self) -> None:
+        self._keys: list[tuple[str, str, int]] = []
+        self._entries: dict[tuple[str, int], Entry] = {}
+        # prefix -> its best `TOP` entries, for prefixes matching over CANDIDATES keys
+        self._top: dict[str, list[Entry]] = {}
+        self._lock = threading.Lock()
+        self.generation = catalogue_generation.value
+
+    @property
+    def stale(self) -> bool:
+        """another worker changed the catalogue, in-place updates only see our own"""
+        shared = catalogue_generation.shared is not None
+        return shared and self.generation != catalogue_generation.value
+
+    def load(self, session: Session) -> None:
+        self.generation = catalogue_generation.value
+        titles = session.exec(
+            select(Title.id, Title.name, func.count(Episode.id))
+            .outerjoin(Episode, Episode.title_id == Title.id)
+            .group_by(Title.id)
+        )
+        tags = session.exec(
+            select(Tag.id, Tag.name, func.count(TitleTagsLink.title_id))
+            .outerjoin(TitleTagsLink, TitleTagsLink.tag_id == Tag.id)
+            .group_by(Tag.id)
+        )
+        entries = [Entry("title", *row) for row in titles]
+        entries += [Entry("tag", *row) for row in tags]
+
+        keys = []
+        for entry in entries:
+            entry.keys = self._word_starts(entry.name)
+            keys += [(key, entry.kind, entry.id) for key in entry.keys]
+        keys.sort()
+
+        with self._lock:
+            self._entries = {(entry.kind, entry.id): entry for entry in entries}
+            self._keys = keys
+            self._top = {}
+
+    def upsert(self, kind: str, id: int, name: str) -> None:
+        with self._lock:
+            entry = self._entries.get((kind, id))
+            if entry is None:
+                entry = self._entries[(kind, id)] = Entry(kind, id, name)
+            else:
+                self._remove_keys(entry)
+                entry.name = name
+            entry.keys = self._word_starts(name)
+            for key in entry.keys:
+                insort(self._keys, (key, kind, id))
+            self._invalidate(entry)
+
+    def remove(self, kind: str, id: int) -> None:
+        with self._lock:
+            entry = self._entries.pop((kind, id), None)
+            if entry is not None:
+                self._remove_keys(entry)
+
+    def add_popularity(self, kind: str, id: int, amount: int) -> None:
+        with self._lock:
+            entry = self._entries.get((kind, id))
+            if entry is not None:
+                entry.popularity += amount
+                self._invalidate(entry)
+
+    def suggest(self, q: str, k: int = 10) -> list[Entry]:
+        prefix = normalize(q)
+        if not prefix:
+            return []
+        with self._lock:
+            top = self._top.get(prefix)
+            if top is None:
+                start = bisect_left(self._keys, (prefix,))
+                # the first string after every one starting with the prefix
+                end = bisect_left(self._keys, (prefix[:-1] + chr(ord(prefix[-1]) + 1),))
+                if end - start <= CANDIDATES or k > TOP:
+                    return self._rank(start, end, k)
+                top = self._top[prefix] = self._rank(start, end, TOP)
+        return top[:k]
+
+    def _rank(self, start: int, end: int, k: int) -> list[Entry]:
+        # in key order, which breaks ties
+        matches = dict.fromkeys((kind, id) for _, kind, id in self._keys[start:end])
+        return heapq.nlargest(
+            k,
+            (self._entries[match] for match in matches),
+            key=lambda entry: (entry.popularity, -len(entry.name)),
+        )
+
+    def _invalidate(self, entry: Entry) -> None:
+        """forget the ranking of every prefix the entry matches"""
+        for key in entry.keys:
+            for end in range(1, len(key) + 1):
+                self._top.pop(key[:end], None)
+
+    def _remove_keys(self, entry: Entry) -> None:
+        self._invalidate(entry)
+        for key in entry.keys:
+            index = bisect_left(self._keys, (key, entry.kind, entry.id))
+            del self._keys[index]
+
+    @staticmethod
+    def _word_starts(name: str) -> list[str]:
+        words = normalize(name).split(" ")
+        return sorted({" ".join(words[i:]) for i in range(len(words)) if words[i]})
+
+
+suggest_index = SuggestIndex()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changes(session, flush_context):
+    changes = session.info.setdefault("suggest_changes", [])
+    for instance in session.new:
+        if isinstance(instance, Episode):
+            changes.append(("popularity", "title", instance.title_id, 1))
+    for instance in session.deleted:
+        if isinstance(instance, Episode):
+            changes.append(("popularity", "title", instance.title_id, -1))
+        elif isinstance(instance, (Title, Tag)):
+            changes.append(("remove", instance.__tablename__, instance.id, None))
+    for instance in [*session.new, *session.dirty]:
+        if isinstance(instance, (Title, Tag)):
+            changes.append(("upsert", instance.__tablename__, instance.id, instance.name))
+    for tag_id, amount in _link_changes([*session.new, *session.dirty]):
+        changes.append(("popularity", "tag", tag_id, amount))
+
+
+def _link_changes(instances) -> list[tuple[int, int]]:
+    """(tag id, +1 or -1) per title linked or unlinked, from either side"""
+    links = set()
+    for instance in instances:
+        if isinstance(instance, Title):
+            history = inspect(instance).attrs.tags.history
+            links |= {(instance.id, tag.id, 1) for tag in history.added}
+            links |= {(instance.id, tag.id, -1) for tag in history.deleted}
+        elif isinstance(instance, Tag):
+            history = inspect(instance).attrs.titles.history
+            links |= {(title.id, instance.id, 1) for title in history.added}
+            links |= {(title.id, instance.id, -1) for title in history.deleted}
+    # back_populates records a link on both sides, the set counts it once
+    return [(tag_id, amount) for _, tag_id, amount in links]
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_changes(session):
+    for action, kind, id, value in session.info.pop("suggest_changes", []):
+        if action == "upsert":
+            suggest_index.upsert(kind, id, value)
+        elif action == "remove":
+            suggest_index.remove(kind, id)
+        else:
+            suggest_index.add_popularity(kind, id, value)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session):
+    session.info.pop("suggest_changes", None)
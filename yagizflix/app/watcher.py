@@ -0,0 +1,146 @@
+"""
+Media library watcher
+
+Keeps the catalogue in sync with the movies directory while the app runs:
+
+- with `watchfiles` (inotify/FSEvents, installed with uvicorn[standard]) bursts
+  of events are debounced and only the touched files are re-synced; a folder
+  added, moved or deleted as a whole reports only itself, so its whole
+  subtree is re-synced
+- without it the library is rescanned every `library_poll_interval` seconds,
+  which the scanner's fingerprints keep cheap
+
+Either way the watcher starts with one incremental scan to pick up whatever
+changed while the app was down.
+"""
+
+import asyncio
+import logging
+from functools import partial
+from pathlib import Path
+
+import anyio
+from sqlalchemy import Engine
+from sqlmodel import Session
+
+from .navigation import episode_orders
+from .page_cache import catalogue_generation
+from .scanner import SUFFIX, LibraryScanner, ScanResult
+from .suggest import suggest_index
+
+try:
+    from watchfiles import awatch
+except ImportError:  # pragma: no cover - polling fallback
+    awatch = None
+
+logger = logging.getLogger(__name__)
+
+
+class LibraryWatcher:
+    def __init__(
+        self,
+        engine: Engine,
+        root: Path,
+        debounce_ms: int = 500,
+        poll_interval: float = 60.0,
+    ) -> None:
+        self.engine = engine
+        self.root = root
+        self.debounce_ms = debounce_ms
+        self.poll_interval = poll_interval
+        self.scanner = LibraryScanner(engine, root)
+        self._stopped = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        # let the watch thread see the event and return, a cancelled task would
+        # leave it running past the event loop
+        self._stopped.set()
+        if self._task is not None:
+            await self._task
+
+    async def run(self) -> None:
+        if not self.root.is_dir():
+            logger.warning("not watching %s, it is not a directory", self.root)
+            return
+        await self.rescan()
+        if awatch is None:
+            await self.poll()
+        else:
+            await self.watch()
+
+    async def watch(self) -> None:
+        async for changes in awatch(
+            self.root, debounce=self.debounce_ms, step=50, stop_event=self._stopped
+        ):
+            paths, trees = set(), set()
+            for _, path in changes:
+                relative = self.relative(Path(path))
+                # the root itself comes out as "", hidden files are skipped by walk
+                if not relative or Path(relative).name.startswith("."):
+                    continue
+                if relative.lower().endswith(SUFFIX):
+                    paths.add(relative[: -len(SUFFIX)])
+                else:
+                    # a directory, or something that was one before it was deleted
+                    trees.add(relative)
+            if paths or trees:
+                await self.sync(sorted(paths), sorted(trees))
+
+    async def poll(self) -> None:
+        while not self._stopped.is_set():
+            with anyio.move_on_after(self.poll_interval):
+                await self._stopped.wait()
+            if not self._stopped.is_set():
+                await self.rescan()
+
+    async def rescan(self) -> None:
+        try:
+            result = await anyio.to_thread.run_sync(self.scanner.scan)
+        except Exception:
+            logger.exception("scanning %s failed", self.root)
+        else:
+            await self.apply(result)
+
+    async def sync(self, paths: list[str], trees: list[str] = ()) -> None:
+        try:
+            result = await anyio.to_thread.run_sync(
+                partial(self.scanner.sync, paths, trees=trees)
+            )
+        except Exception:
+            logger.exception(
+                "syncing %d library files and %d folders failed", len(paths), len(trees)
+            )
+        else:
+            await self.apply(result)
+
+    async def apply(self, result: ScanResult) -> None:
+        if not result.changed:
+            return
+        logger.info(
+            "library changed: %d added, %d updated, %d renamed, %d removed",
+            len(result.added),
+            len(result.updated),
+            len(result.renamed),
+            len(result.removed),
+        )
+        # the scanner writes in bulk, past the ORM events that keep these current
+        episode_orders.clear()
+        catalogue_generation.bump()
+        with Session(self.engine) as session:
+            await anyio.to_thread.run_sync(suggest_index.load, session)
+
+    def relative(self, path: Path) -> str | None:
+        """`path` relative to the media root, None when it is outside of it"""
+        # a symlinked root can report events under its resolved path
+        for root in (self.root, self.root.resolve()):
+            try:
+                relative = path.relative_to(root).as_posix()
+            except ValueError:
+                continue
+            return "" if relative == "." else relative
+        logger.warning("ignoring a change outside of %s: %s", self.root, path)
+        return None
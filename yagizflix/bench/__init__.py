@@ -0,0 +1,17 @@
+"""
+Benchmarks
+
+`python -m bench` (run from the project root) generates a library of synthetic
+MP4s (sparse files with a real moov, so probing works), scans it into a fresh
+database and drives the app in-process with concurrent workloads:
+
+- viewers open an episode's player page, start the stream, seek around with
+  Range requests and move on to the next episode
+- browsers load the titles page, a row of it from the API and a title page
+
+Requests go straight into the ASGI app, so the numbers are the app's own
+cost without sockets or HTTP parsing. The JSON report has throughput,
+p50/p99 latency and time to first byte per kind of request, bytes/s overall
+and per CPU second, and how many SQL statements the run took. Everything is
+seeded, `python -m bench --help` lists the knobs.
+"""
@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .catalogue import generate
+from .runner import Driver, browser, viewer
+
+MiB = 1024 * 1024
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m bench")
+    parser.add_argument("--viewers", type=int, default=16)
+    parser.add_argument("--browsers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--titles", type=int, default=200)
+    parser.add_argument("--episodes", type=int, default=12, help="at most, per title")
+    parser.add_argument("--tags", type=int, default=8)
+    parser.add_argument("--file-size", type=int, default=64 * MiB, help="bytes")
+    parser.add_argument("--chunk", type=int, default=MiB, help="bytes per range")
+    parser.add_argument("--seeks", type=int, default=4, help="at most, per episode")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="JSON report, stdout without it")
+    return parser.parse_args()
+
+
+def configure(workdir: Path) -> Path:
+    """
+    point the app's settings into `workdir`, before anything imports them;
+    nothing renders or encodes in the background, ffmpeg is never started
+    """
+    movies = workdir / "movies"
+    os.environ.update(
+        DATABASE_URL=f"sqlite:///{workdir / 'bench.db'}",
+        MOVIES_PATH=str(movies),
+        HLS_PATH=str(workdir / "hls"),
+        ARTWORK_PATH=str(workdir / "artwork"),
+        RENDITIONS_PATH=str(workdir / "renditions"),
+        TEMPLATE_CACHE_PATH=str(workdir / "template_cache"),
+        ARTWORK_WORKERS="0",
+        TRANSCODE_WORKERS="0",
+        FFMPEG_PATH=str(workdir / "no-ffmpeg"),
+        WATCH_LIBRARY="false",
+    )
+    return movies
+
+
+async def run(args: argparse.Namespace, workdir: Path) -> dict:
+    movies = configure(workdir)
+    files = generate(
+        movies, args.titles, args.episodes, args.tags, args.file_size, args.seed
+    )
+
+    from sqlalchemy import event, select
+    from sqlmodel import Session
+
+    from app.database import create_db_and_tables, engine, read_engine
+    from app.main import app
+    from app.models import Episode, Tag
+    from app.scanner import LibraryScanner
+
+    create_db_and_tables()
+    scan_started = time.perf_counter()
+    LibraryScanner(engine, movies).scan()
+    scan_seconds = time.perf_counter() - scan_started
+
+    with Session(engine) as session:
+        rows = session.execute(
+            select(Episode.title_id, Episode.id).order_by(
+                Episode.title_id, Episode.season, Episode.episode_number
+            )
+        ).all()
+        tag_ids = list(session.execute(select(Tag.id)).scalars())
+    shows: dict[int, list[int]] = {}
+    for title_id, episode_id in rows:
+        shows.setdefault(title_id, []).append(episode_id)
+
+    queries = 0
+
+    def count_query(*_):
+        nonlocal queries
+        queries += 1
+
+    for target in (engine, read_engine):
+        event.listen(target, "before_cursor_execute", count_query)
+
+    driver = Driver(app)
+    rng = random.Random(args.seed)
+    async with app.router.lifespan_context(app):
+        queries = 0
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(
+            *(
+                viewer(
+                    driver,
+                    random.Random(rng.random()),
+                    list(shows.values()),
+                    args.file_size,
+                    args.chunk,
+                    args.seeks,
+                    deadline,
+                )
+                for _ in range(args.viewers)
+            ),
+            *(
+                browser(driver, random.Random(rng.random()), tag_ids, list(shows), deadline)
+                for _ in range(args.browsers)
+            ),
+        )
+        elapsed = time.perf_counter() - started
+        cpu_seconds = time.process_time() - cpu_started
+        run_queries = queries
+
+    requests = sum(len(op.latencies) for op in driver.operations.values())
+    total_bytes = sum(op.bytes for op in driver.operations.values())
+    return {
+        "config": {
+            key: str(value) if isinstance(value, Path) else value
+            for key, value in vars(args).items()
+        },
+        "catalogue": {"files": files, "titles": len(shows), "scan_seconds": scan_seconds},
+        "elapsed": elapsed,
+        "cpu_seconds": cpu_seconds,
+        "requests": requests,
+        "throughput": requests / elapsed,
+        "bytes_per_second": total_bytes / elapsed,
+        "bytes_per_cpu_second": total_bytes / cpu_seconds if cpu_seconds else None,
+        "db_queries": run_queries,
+        "db_queries_per_request": run_queries / requests if requests else None,
+        "operations": {
+            name: operation.report(elapsed)
+            for name, operation in sorted(driver.operations.items())
+        },
+    }
+
+
+def main() -> None:
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="yagizflix-bench-") as workdir:
+        report = asyncio.run(run(args, Path(workdir)))
+
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        args.output.write_text(text + "\n")
+        print(f"wrote {args.output}", file=sys.stderr)
+
+
+main()
@@ -0,0 +1,59 @@
+"""synthetic media library for benchmarks"""
+
+import random
+import struct
+from pathlib import Path
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", len(payload) + 8, box_type) + payload
+
+
+def mp4_header(duration: float) -> bytes:
+    """ftyp + a moov holding only mvhd, enough for app.probe"""
+    ftyp = box(b"ftyp", b"isom" + struct.pack(">I", 0x200) + b"isomiso2mp41")
+    timescale = 1000
+    mvhd = (
+        struct.pack(">IIIII", 0, 0, 0, timescale, int(duration * timescale))
+        + struct.pack(">IH", 0x00010000, 0x0100)
+        + bytes(10)  # reserved
+        + struct.pack(">9I", 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+        + bytes(24)  # pre_defined
+        + struct.pack(">I", 2)  # next track id
+    )
+    return ftyp + box(b"moov", box(b"mvhd", mvhd))
+
+
+def write_mp4(path: Path, size: int, duration: float) -> None:
+    """a faststart file of `size` bytes, mdat is a hole so it costs no disk"""
+    header = mp4_header(duration)
+    mdat_size = size - len(header)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(header + struct.pack(">I4s", mdat_size, b"mdat"))
+        file.truncate(size)
+
+
+def generate(
+    root: Path,
+    titles: int,
+    episodes: int,
+    tags: int,
+    file_size: int,
+    seed: int = 0,
+) -> int:
+    """
+    `titles` shows of up to `episodes` episodes each, spread over `tags` folders;
+    returns how many files were written
+    """
+    rng = random.Random(seed)
+    written = 0
+    for number in range(titles):
+        tag = f"tag_{number % tags:02d}"
+        count = rng.randint(1, episodes)
+        for episode in range(count):
+            season, episode_number = divmod(episode, 10)
+            name = f"show_{number:04d}_s{season + 1:02d}e{episode_number + 1:02d}.mp4"
+            write_mp4(root / tag / name, file_size, duration=rng.uniform(1200, 3600))
+            written += 1
+    return written
@@ -0,0 +1,141 @@
+"""in-process ASGI load driver and the viewer/browser workloads"""
+
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Operation:
+    latencies: list[float] = field(default_factory=list)
+    first_bytes: list[float] = field(default_factory=list)
+    statuses: dict[int, int] = field(default_factory=dict)
+    errors: int = 0
+    bytes: int = 0
+
+    def report(self, elapsed: float) -> dict:
+        return {
+            "count": len(self.latencies),
+            "errors": self.errors,
+            "statuses": {str(status): n for status, n in sorted(self.statuses.items())},
+            "throughput": len(self.latencies) / elapsed,
+            "latency_p50": percentile(self.latencies, 50),
+            "latency_p99": percentile(self.latencies, 99),
+            "ttfb_p50": percentile(self.first_bytes, 50),
+            "ttfb_p99": percentile(self.first_bytes, 99),
+            "bytes": self.bytes,
+        }
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))]
+
+
+class Driver:
+    """sends requests straight into the ASGI app, no sockets or HTTP parsing"""
+
+    def __init__(self, app) -> None:
+        self.app = app
+        self.operations: dict[str, Operation] = {}
+
+    async def get(self, operation: str, url: str, headers: dict | None = None) -> int:
+        path, _, query = url.partition("?")
+        scope = {
+            "type": "http",
+            # 2.4 servers report disconnects on send, no listener task per response
+            "asgi": {"version": "3.0", "spec_version": "2.4"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": [(b"host", b"bench")]
+            + [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+            "client": ("127.0.0.1", 0),
+            "server": ("bench", 80),
+            "extensions": {},
+        }
+        stats = self.operations.setdefault(operation, Operation())
+        done = asyncio.Event()
+        requested = False
+        status = 0
+        first_byte = None
+        started = time.perf_counter()
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status, first_byte
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                if body and first_byte is None:
+                    first_byte = time.perf_counter()
+                stats.bytes += len(body)
+
+        try:
+            await self.app(scope, receive, send)
+        except Exception:
+            stats.errors += 1
+            return 0
+        finally:
+            done.set()
+
+        stats.latencies.append(time.perf_counter() - started)
+        if first_byte is not None:
+            stats.first_bytes.append(first_byte - started)
+        stats.statuses[status] = stats.statuses.get(status, 0) + 1
+        return status
+
+
+async def viewer(
+    driver: Driver,
+    rng: random.Random,
+    shows: list[list[int]],
+    file_size: int,
+    chunk: int,
+    seeks: int,
+    deadline: float,
+) -> None:
+    """starts a show, seeks around each episode and moves on to the next one"""
+    episodes = rng.choice(shows)
+    index = 0
+    while time.perf_counter() < deadline:
+        episode_id = episodes[index]
+        await driver.get("player_page", f"/player/?q={episode_id}")
+        stream = f"/player/stream?q={episode_id}"
+        await driver.get("stream_start", stream, {"range": f"bytes=0-{chunk - 1}"})
+        for _ in range(rng.randint(1, seeks)):
+            start = rng.randrange(0, file_size - chunk)
+            await driver.get(
+                "stream_seek", stream, {"range": f"bytes={start}-{start + chunk - 1}"}
+            )
+        index = (index + 1) % len(episodes)
+
+
+async def browser(
+    driver: Driver,
+    rng: random.Random,
+    tag_ids: list[int],
+    title_ids: list[int],
+    deadline: float,
+) -> None:
+    """the browse page, a row of it from the API and a title page"""
+    while time.perf_counter() < deadline:
+        await driver.get("titles_page", "/titles/titles")
+        tag = rng.choice(tag_ids)
+        await driver.get("api_titles", f"/api/titles?tag={tag}&fields=id,name&limit=24")
+        await driver.get("title_detail", f"/titles/titles/{rng.choice(title_ids)}")
@@ -0,0 +1,92 @@
+"""
+The tests run the app in-process against a small synthetic library (see
+bench.catalogue) in a temporary directory. Settings are read once, so they
+are pointed there before anything imports the app.
+"""
+
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+
+WORKDIR = Path(tempfile.mkdtemp(prefix="yagizflix-tests-"))
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{WORKDIR / 'test.db'}",
+    MOVIES_PATH=str(WORKDIR / "movies"),
+    HLS_PATH=str(WORKDIR / "hls"),
+    ARTWORK_PATH=str(WORKDIR / "artwork"),
+    RENDITIONS_PATH=str(WORKDIR / "renditions"),
+    TEMPLATE_CACHE_PATH=str(WORKDIR / "template_cache"),
+    FFMPEG_PATH=str(WORKDIR / "no-ffmpeg"),
+    WATCH_LIBRARY="false",
+)
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import event, select  # noqa: E402
+
+from app.database import create_db_and_tables, engine, read_engine  # noqa: E402
+from app.main import app  # noqa: E402
+from app.metrics import request_stats  # noqa: E402
+from app.models import Episode, Tag  # noqa: E402
+from app.navigation import episode_orders  # noqa: E402
+from app.page_cache import page_cache  # noqa: E402
+from app.scanner import LibraryScanner  # noqa: E402
+from bench.catalogue import generate  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def library():
+    """ids of a tag, a title and an episode of the scanned library"""
+    movies = WORKDIR / "movies"
+    generate(movies, titles=30, episodes=12, tags=4, file_size=64 * 1024)
+    create_db_and_tables()
+    LibraryScanner(engine, movies).scan()
+    with engine.connect() as connection:
+        tag_id = connection.execute(select(Tag.id).limit(1)).scalar_one()
+        episode_id, title_id = connection.execute(
+            select(Episode.id, Episode.title_id).limit(1)
+        ).one()
+    yield {"tag_id": tag_id, "title_id": title_id, "episode_id": episode_id}
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def client(library):
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def cold_caches():
+    """every request reaches the database"""
+    page_cache.clear()
+    episode_orders.clear()
+
+
+@pytest.fixture
+def count_queries():
+    """
+    a context manager collecting the SQL statements requests send, the
+    middleware's request_stats tells them apart from the background tasks'
+    """
+
+    @contextmanager
+    def counting():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if request_stats.get() is not None:
+                statements.append(statement)
+
+        for target in (engine, read_engine):
+            event.listen(target, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            for target in (engine, read_engine):
+                event.remove(target, "before_cursor_execute", before_cursor_execute)
+
+    return counting
@@ -0,0 +1,58 @@
+import time
+
+from sqlmodel import Session
+
+from app.artwork import digest_path, save_artwork
+from app.config import get_app_settings
+from app.database import engine
+from app.models import Episode
+from app.routers.player import artwork
+
+
+def wait_for_failure(key, timeout: float = 10.0) -> tuple[int, float]:
+    deadline = time.monotonic() + timeout
+    while key not in artwork._failures:
+        assert time.monotonic() < deadline, "the render never finished"
+        time.sleep(0.05)
+    return artwork._failures[key]
+
+
+def test_poster_is_served_without_redirects(client, library):
+    response = client.get(
+        f"/player/artwork/{library['episode_id']}/poster", follow_redirects=False
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/svg+xml"
+
+    response = client.get(
+        f"/titles/titles/{library['title_id']}/poster", follow_redirects=False
+    )
+    assert response.status_code == 200
+
+
+def test_failed_render_is_not_retried_per_view(client, library):
+    key = (library["episode_id"], "poster")
+    client.get(f"/player/artwork/{key[0]}/poster")
+    count, retry_at = wait_for_failure(key)
+    assert retry_at > time.monotonic()
+
+    client.get(f"/player/artwork/{key[0]}/poster")
+    assert key not in artwork._jobs
+    assert artwork._failures[key] == (count, retry_at)
+
+
+def test_player_links_the_rendered_sprite(client, library):
+    settings = get_app_settings()
+    episode_id = library["episode_id"]
+    with Session(engine) as session:
+        name = session.get(Episode, episode_id).name
+    source = settings.movies_path / f"{name}.mp4"
+    digest = "ab" * 32
+    image = digest_path(settings.artwork_path, digest)
+    image.parent.mkdir(parents=True, exist_ok=True)
+    image.write_bytes(b"\xff\xd8\xff")
+    save_artwork(engine, episode_id, "sprite", source.stat().st_mtime_ns, digest)
+
+    page = client.get(f"/player/?q={episode_id}").text
+    assert f"/player/artwork/{digest}.jpg" in page
+    assert 'id="seek"' in page
@@ -0,0 +1,78 @@
+import struct
+
+import pytest
+
+from app.faststart import faststart, offset_tables, parse, read_offsets
+from app.probe import iter_boxes
+from bench.catalogue import box
+
+CHUNK = 16
+FTYP = box(b"ftyp", b"isom\0\0\0\0isom")
+
+
+def chunks(first: int, count: int) -> list[bytes]:
+    return [f"chunk {first + i:<10}".encode() for i in range(count)]
+
+
+def moov(table: bytes, offsets: list[int]) -> bytes:
+    width = "I" if table == b"stco" else "Q"
+    entries = struct.pack(f">II{len(offsets)}{width}", 0, len(offsets), *offsets)
+    stbl = box(b"stbl", box(table, entries))
+    return box(b"moov", box(b"trak", box(b"mdia", box(b"minf", stbl))))
+
+
+def write_moov_at_end(path, table: bytes, trailing: bool = False) -> list[bytes]:
+    """ftyp, mdat, moov and with `trailing` another mdat behind it, returns the chunks"""
+    front = chunks(0, 4)
+    back = chunks(4, 2) if trailing else []
+    mdat = box(b"mdat", b"".join(front))
+    front_offsets = [len(FTYP) + 8 + i * CHUNK for i in range(len(front))]
+    # the moov's size doesn't depend on the offsets in it
+    moov_size = len(moov(table, [0] * (len(front) + len(back))))
+    back_start = len(FTYP) + len(mdat) + moov_size + 8
+    back_offsets = [back_start + i * CHUNK for i in range(len(back))]
+    data = FTYP + mdat + moov(table, front_offsets + back_offsets)
+    if back:
+        data += box(b"mdat", b"".join(back))
+    path.write_bytes(data)
+    return front + back
+
+
+def top_level(path) -> list:
+    with open(path, "rb") as file:
+        return list(iter_boxes(file, 0, path.stat().st_size))
+
+
+def chunks_at_offsets(path) -> tuple[list[bytes], list[bytes]]:
+    """the offset tables' types and the chunk each offset points at"""
+    data = path.read_bytes()
+    found = next(found for found in top_level(path) if found.type == b"moov")
+    tree = parse(data[found.offset : found.end])
+    tables = list(offset_tables(tree))
+    offsets = [offset for table in tables for offset in read_offsets(table)]
+    return [table[0] for table in tables], [data[o : o + CHUNK] for o in offsets]
+
+
+@pytest.mark.parametrize("table", [b"stco", b"co64"])
+@pytest.mark.parametrize("trailing", [False, True])
+def test_offsets_point_at_the_same_bytes(tmp_path, table, trailing):
+    path = tmp_path / "episode.mp4"
+    expected = write_moov_at_end(path, table, trailing)
+    assert chunks_at_offsets(path) == ([table], expected)
+    size = path.stat().st_size
+
+    assert faststart(path)
+    order = [found.type for found in top_level(path)]
+    assert order.index(b"moov") < order.index(b"mdat")
+    assert path.stat().st_size == size
+    assert chunks_at_offsets(path) == ([table], expected)
+
+
+def test_faststart_files_are_left_alone(tmp_path):
+    path = tmp_path / "episode.mp4"
+    write_moov_at_end(path, b"stco")
+    faststart(path)
+    data = path.read_bytes()
+
+    assert not faststart(path)
+    assert path.read_bytes() == data
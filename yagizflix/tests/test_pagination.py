@@ -0,0 +1,65 @@
+import pytest
+from sqlmodel import Session, select
+
+from app.database import engine
+from app.models import Title, TitleTagsLink
+from app.pagination import encode_cursor
+
+
+def all_pages(client, url: str, **params) -> list[dict]:
+    items, after = [], None
+    while True:
+        if after is not None:
+            params["after"] = after
+        page = client.get(url, params={"limit": 7, **params}).json()
+        items += page["items"]
+        after = page["next"]
+        if after is None:
+            return items
+
+
+def test_tag_pages_follow_title_names(client, library):
+    tag_id = library["tag_id"]
+    with Session(engine) as session:
+        expected = session.exec(
+            select(Title.id)
+            .join(TitleTagsLink, TitleTagsLink.title_id == Title.id)
+            .where(TitleTagsLink.tag_id == tag_id)
+            .order_by(Title.name, Title.id)
+        ).all()
+    items = all_pages(client, "/api/titles", tag=tag_id)
+    assert [item["id"] for item in items] == expected
+
+
+def test_renamed_title_moves_within_its_tag(client, library):
+    with Session(engine) as session:
+        title = session.exec(
+            select(Title)
+            .join(TitleTagsLink, TitleTagsLink.title_id == Title.id)
+            .where(TitleTagsLink.tag_id == library["tag_id"])
+            .order_by(Title.name)
+        ).first()
+        name, title.name = title.name, "~ last"
+        session.commit()
+        try:
+            items = all_pages(client, "/api/titles", tag=library["tag_id"])
+            assert items[-1]["id"] == title.id
+        finally:
+            title.name = name
+            session.commit()
+
+
+@pytest.mark.parametrize(
+    "key",
+    [
+        [{"a": 1}, 2],
+        ["name", "2"],
+        ["name", True],
+        ["name"],
+        "name",
+    ],
+)
+def test_malformed_cursor_is_rejected(client, key):
+    after = encode_cursor(key) if isinstance(key, list) else key
+    response = client.get("/api/titles", params={"after": after})
+    assert response.status_code == 400
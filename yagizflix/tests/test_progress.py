@@ -0,0 +1,28 @@
+from sqlmodel import Session, delete, select
+
+from app.database import engine
+from app.models import Episode
+from app.progress import ProgressBuffer
+
+
+def test_removed_episodes_do_not_hold_up_the_batch(library):
+    with Session(engine) as session:
+        removed = Episode(title_id=library["title_id"], name="removed episode")
+        session.add(removed)
+        session.commit()
+        removed_id = removed.id
+
+    buffer = ProgressBuffer(engine)
+    buffer.record(library["episode_id"], 42)
+    buffer.record(removed_id, 7)
+    # the scanner removes the file between the heartbeat and the flush
+    with Session(engine) as session:
+        session.exec(delete(Episode).where(Episode.id == removed_id))
+        session.commit()
+
+    assert buffer.flush() == 2
+    assert buffer.pending_position(removed_id) is None
+    with Session(engine) as session:
+        episode = session.exec(select(Episode).where(Episode.id == library["episode_id"])).one()
+        assert episode.left_at == 42
+    assert buffer.flush() == 0
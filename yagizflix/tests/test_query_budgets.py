@@ -0,0 +1,32 @@
+"""
+Statements a cold request may send. A page that starts lazy loading a
+relationship per row goes over its budget as soon as the library has more
+than a handful of rows.
+"""
+
+import pytest
+
+
+@pytest.mark.usefixtures("cold_caches")
+@pytest.mark.parametrize(
+    ("url", "budget"),
+    [
+        ("/titles/titles", 1),
+        ("/titles/titles/{title_id}", 2),
+        ("/player/?q={episode_id}", 5),
+        ("/api/titles?tag={tag_id}", 1),
+    ],
+)
+def test_query_budget(client, library, count_queries, url, budget):
+    with count_queries() as statements:
+        response = client.get(url.format(**library))
+    assert response.status_code == 200
+    assert len(statements) <= budget, "\n".join(statements)
+
+
+def test_cached_page_sends_no_queries(client, library, count_queries):
+    client.get("/titles/titles")
+    with count_queries() as statements:
+        response = client.get("/titles/titles")
+    assert response.status_code == 200
+    assert statements == []
@@ -0,0 +1,62 @@
+import pytest
+
+from sqlalchemy import select
+
+from app.database import engine, read_engine
+from app.models import Episode
+from app.query_plans import exercise, explain, problems, record_statements
+
+
+def slow_statements(run) -> dict[str, list[str]]:
+    slow = {}
+    for statement, parameters in record_statements([engine, read_engine], run):
+        plan = explain(statement, parameters)
+        if problems(plan):
+            slow[" ".join(statement.split())] = plan
+    return slow
+
+
+@pytest.mark.usefixtures("cold_caches")
+def test_routes_use_indexes(client, library):
+    assert slow_statements(lambda: exercise(client, **library)) == {}
+
+
+def test_hot_paths_are_checked(client, library):
+    statements = [
+        " ".join(statement.split())
+        for statement, _ in record_statements(
+            [engine, read_engine], lambda: exercise(client, **library)
+        )
+    ]
+    # the progress flush, an executemany UPDATE
+    assert any(statement.startswith("UPDATE episode SET") for statement in statements)
+
+
+def test_unindexed_statements_fail_the_check(library):
+    def run():
+        with read_engine.connect() as connection:
+            connection.execute(select(Episode.id).where(Episode.completed == True))  # noqa: E712
+
+    assert list(slow_statements(run)) == [
+        "SELECT episode.id FROM episode WHERE episode.completed = 1"
+    ]
+
+
+@pytest.mark.parametrize(
+    ("plan", "slow"),
+    [
+        (["SCAN title"], True),
+        (["SCAN title USING INDEX ix_title_name_id"], False),
+        (
+            [
+                "SEARCH titletagslink USING COVERING INDEX ix_titletagslink_tag_id_title_id (tag_id=?)",
+                "SEARCH title USING INTEGER PRIMARY KEY (rowid=?)",
+                "USE TEMP B-TREE FOR ORDER BY",
+            ],
+            True,
+        ),
+        (["SCAN title_search VIRTUAL TABLE INDEX 0:M3", "USE TEMP B-TREE FOR ORDER BY"], False),
+    ],
+)
+def test_problems(plan, slow):
+    assert bool(problems(plan)) is slow
@@ -0,0 +1,23 @@
+from app.renditions import LADDER, ladder_for
+
+
+def test_unprobed_episodes_get_no_rungs():
+    assert ladder_for(None) == []
+
+
+def test_rungs_stay_below_the_source():
+    source = LADDER[1].bitrate
+    assert [rung.name for rung in ladder_for(source)] == [
+        rung.name for rung in LADDER[2:]
+    ]
+
+
+def test_stream_ranges_only_read(client, library, count_queries):
+    with count_queries() as statements:
+        response = client.get(
+            "/player/stream",
+            params={"q": library["episode_id"]},
+            headers={"Range": "bytes=0-1023"},
+        )
+    assert response.status_code == 206
+    assert all(statement.lstrip().upper().startswith("SELECT") for statement in statements)
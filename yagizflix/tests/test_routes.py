@@ -0,0 +1,25 @@
+import inspect
+
+from fastapi.routing import APIRoute
+
+from app.database import get_read_session
+from app.main import app
+
+# waits for a stream slot, its database work goes through anyio.to_thread
+ASYNC_WITH_SESSION = {"stream"}
+
+
+def test_routes_with_a_session_run_in_the_threadpool():
+    # streams send from the event loop, a query on it pauses every one of them
+    blocking = [
+        route.name
+        for route in app.routes
+        if isinstance(route, APIRoute)
+        and inspect.iscoroutinefunction(route.endpoint)
+        and any(
+            dependency.call is get_read_session
+            for dependency in route.dependant.dependencies
+        )
+        and route.name not in ASYNC_WITH_SESSION
+    ]
+    assert blocking == []
@@ -0,0 +1,20 @@
+import pytest
+from sqlalchemy import select, update
+
+from app.database import engine
+from app.models import Episode
+from app.query_plans import explain, problems
+
+
+@pytest.mark.parametrize(
+    "statement",
+    [
+        # looking up a batch of scanned files
+        select(Episode.name, Episode.id).where(Episode.name.in_(["a.mp4", "b.mp4"])),
+        # a rename
+        update(Episode).where(Episode.name == "a.mp4").values(name="b.mp4"),
+    ],
+)
+def test_episodes_are_found_by_path_through_an_index(library, statement):
+    compiled = statement.compile(engine, compile_kwargs={"literal_binds": True})
+    assert problems(explain(str(compiled), ())) == []
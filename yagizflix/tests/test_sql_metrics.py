@@ -0,0 +1,13 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from app.database import read_engine
+
+
+def test_failed_statements_leave_nothing_on_the_connection(library):
+    with read_engine.connect() as connection:
+        with pytest.raises(OperationalError):
+            connection.exec_driver_sql("SELECT * FROM no_such_table")
+        assert "metrics_started" not in connection.info
+        connection.exec_driver_sql("SELECT 1")
+        assert "metrics_started" not in connection.info
@@ -0,0 +1,56 @@
+from sqlmodel import Session
+
+from app.database import engine
+from app.models import Tag, Title
+from app.suggest import CANDIDATES, SuggestIndex, suggest_index
+
+
+def popularity(kind: str, id: int) -> int:
+    return suggest_index._entries[(kind, id)].popularity
+
+
+def test_linking_titles_updates_tag_popularity(client):
+    with Session(engine) as session:
+        tag = Tag(name="zz linked tag")
+        first, second = Title(name="zz first"), Title(name="zz second")
+        session.add_all([tag, first, second])
+        session.commit()
+        assert popularity("tag", tag.id) == 0
+
+        first.tags.append(tag)
+        tag.titles.append(second)
+        session.commit()
+        assert popularity("tag", tag.id) == 2
+
+        first.tags.remove(tag)
+        session.commit()
+        assert popularity("tag", tag.id) == 1
+
+        session.delete(first)
+        session.delete(second)
+        session.delete(tag)
+        session.commit()
+
+
+def test_suggestions_rank_by_popularity(client):
+    names = [entry.name for entry in suggest_index.suggest("show", 3)]
+    assert len(names) == 3
+    ranked = suggest_index.suggest("show", 50)
+    assert [entry.popularity for entry in ranked] == sorted(
+        (entry.popularity for entry in ranked), reverse=True
+    )
+
+
+def test_ranking_covers_every_match():
+    index = SuggestIndex()
+    for id in range(CANDIDATES + 50):
+        index.upsert("title", id, f"qq {id:04}")
+    last = CANDIDATES + 49
+    index.add_popularity("title", last, 10)
+    assert [entry.id for entry in index.suggest("q", 1)] == [last]
+
+    # the cached ranking follows popularity changes
+    index.add_popularity("title", 0, 20)
+    assert [entry.id for entry in index.suggest("q", 2)] == [0, last]
+    index.remove("title", 0)
+    assert [entry.id for entry in index.suggest("qq", 1)] == [last]
@@ -0,0 +1,14 @@
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).parents[2]
+VENDORED = ["app/metrics.py", "app/streaming.py"]
+
+
+@pytest.mark.parametrize("path", VENDORED)
+def test_copies_match_home_media_server(path):
+    other = ROOT / "home-media-server" / path
+    if not other.is_file():
+        pytest.skip("home-media-server is not checked out next to yagizflix")
+    assert (ROOT / "yagizflix" / path).read_bytes() == other.read_bytes()